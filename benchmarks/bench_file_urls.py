@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the assessment image url rewriting done in ka_sushi_chef.create_node.
+
+Times localize_file_urls against the previous match-then-resub loop on synthetic,
+image-heavy Perseus items, and checks that both produce the same item data.
+
+Usage:
+  python benchmarks/bench_file_urls.py [--items=N] [--images=N] [--repeat=N]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from ka_sushi_chef import FILE_URL_REGEX, REPLACE_STRING, IMAGE_DL_LOCATION, localize_file_urls  # noqa: E402
+
+
+def legacy_localize_file_urls(item_data):
+    for match in re.finditer(FILE_URL_REGEX, item_data):
+        file_path = str(match.group(0)).replace('\\', '')
+        file_path = file_path.replace(REPLACE_STRING, IMAGE_DL_LOCATION)
+        item_data = re.sub(FILE_URL_REGEX, file_path, item_data, 1)
+    return item_data
+
+
+def make_perseus_item(rng, num_images):
+    """
+    Build the item_data string of a Perseus item referencing num_images localized images
+    and graphies, half of them with the escaped slashes KA's API sometimes returns.
+    """
+    def image_url():
+        filename = "%040x" % rng.getrandbits(160)
+        url = "/content/assessment/khan/{0}/{1}.{2}".format(filename[:3], filename, rng.choice(["png", "svg", "jpg"]))
+        return url.replace("/", "\\/") if rng.random() < 0.5 else url
+
+    widgets = {}
+    content = []
+    for i in range(num_images):
+        content.append("Look at the figure: ![](web+graphie:{0}) and [[☃ image {1}]]".format(image_url(), i))
+        widgets["image {0}".format(i)] = {
+            "type": "image",
+            "options": {"backgroundImage": {"url": image_url(), "width": 400, "height": 300}},
+        }
+    return json.dumps({
+        "question": {"content": "\n\n".join(content), "images": {}, "widgets": widgets},
+        "answerArea": {"calculator": False},
+        "hints": [{"content": "![]({0})".format(image_url()), "images": {}, "widgets": {}} for _ in range(3)],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=200)
+    parser.add_argument("--images", type=int, default=40, help="images per item")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    items = [make_perseus_item(rng, args.images) for _ in range(args.items)]
+
+    for item in items:
+        assert localize_file_urls(item) == legacy_localize_file_urls(item)
+
+    print("{items} items, {images} images each".format(items=args.items, images=args.images))
+    for name, fn in [("legacy", legacy_localize_file_urls), ("single-pass", localize_file_urls)]:
+        best = min(timeit.repeat(lambda: [fn(item) for item in items], number=1, repeat=args.repeat))
+        print("{name:>12}: {total:8.2f} ms total, {per_item:8.3f} ms/item".format(
+            name=name, total=best * 1000, per_item=best * 1000 / args.items))
+
+
+if __name__ == "__main__":
+    main()
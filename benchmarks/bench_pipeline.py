@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Benchmark the CPU-bound stages of the content pack pipeline and the sushi chef on a
+synthetic KA topic tree, reporting the wall time and peak Python memory of each stage.
+
+Every stage runs twice on fresh inputs: once to time it, and once under tracemalloc to
+measure the peak memory it allocates.
+
+Usage:
+  python benchmarks/bench_pipeline.py [--scale=N] [--stages=NAME,...]
+  python benchmarks/bench_pipeline.py --list
+"""
+import argparse
+import collections
+import copy
+import gc
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from benchmarks import synthetic  # noqa: E402
+from contentpacks import khanacademy  # noqa: E402
+from contentpacks.utils import Catalog, translate_nodes, translate_assessment_item_text  # noqa: E402
+
+
+class Inputs:
+    """
+    The synthetic data all stages are derived from, generated once per benchmark run.
+    """
+
+    def __init__(self, scale, seed, items_per_exercise, images_per_item):
+        self.topictree = synthetic.make_topictree(scale, seed, items_per_exercise)
+        self.assessment_items = synthetic.make_assessment_items(self.topictree, seed, images_per_item)
+        self.catalog = Catalog()
+        self.catalog.update(synthetic.make_catalog(self.topictree, seed))
+        self.catalog.update(synthetic.make_item_catalog(self.assessment_items, seed))
+        self._nodes = None
+
+    def cleaned_nodes(self):
+        """
+        Return the flattened, snake_cased node list that download_and_clean_kalite_data
+        hands to create_paths_remove_orphans_and_empty_topics.
+        """
+        topictree = copy.deepcopy(self.topictree)
+        for key in topictree:
+            topictree[key] = khanacademy.convert_all_nodes_to_camel_case(topictree[key])
+        topics = []
+        for node in topictree["topics"]:
+            hidden = node.pop("hide")
+            deleted = node.pop("deleted")
+            if not (hidden or deleted) or node["id"] == synthetic.ROOT_ID:
+                topics.append(node)
+        topictree["topics"] = topics
+        nodes = [node for node_list in topictree.values() for node in node_list]
+        nodes = khanacademy.modify_slugs(nodes)
+        nodes = khanacademy.apply_black_list(nodes)
+        return khanacademy.prune_assessment_items(nodes)
+
+    def nodes(self):
+        """
+        Return the node data as it comes out of retrieve_kalite_data.
+        """
+        if self._nodes is None:
+            nodes = khanacademy.create_paths_remove_orphans_and_empty_topics(self.cleaned_nodes())
+            self._nodes = khanacademy.modify_ids(nodes, lang=khanacademy.EN_LANG_CODE)
+        return copy.deepcopy(self._nodes)
+
+    def chef_nodes(self):
+        """
+        Return the node data as the sushi chef reads it from the node store.
+        """
+        return sorted((node.to_dict() for node in self.nodes()), key=lambda node: node["sort_order"])
+
+    def localized_items(self):
+        """
+        Return the assessment items as the sushi chef reads them from the assessment store.
+        """
+        items = {}
+        for item in copy.deepcopy(self.assessment_items):
+            item = khanacademy.localize_image_urls(item)
+            item = khanacademy.localize_graphie_urls(item)
+            items[item["id"]] = item
+        return items
+
+    def exercise_metadata(self):
+        return {
+            exercise["name"]: {
+                "image_url_256": "https://cdn.kastatic.org/images/{}.png".format(exercise["name"]),
+                "suggested_completion_criteria": "num_correct_in_a_row_5",
+            }
+            for exercise in self.topictree["exercises"]
+        }
+
+
+def _build_tree(inputs):
+    import ka_sushi_chef
+    return (ka_sushi_chef._build_tree, inputs.chef_nodes(), inputs.localized_items(), khanacademy.EN_LANG_CODE,
+            inputs.exercise_metadata(), False)
+
+
+def _clean_nodes(inputs):
+    import ka_sushi_chef
+    args = _build_tree(inputs)
+    return ka_sushi_chef.clean_nodes, args[0](*args[1:])
+
+
+def _localize_items(localize):
+    def setup(inputs):
+        # localize_content_links looks content up by readable id, which would otherwise
+        # pull the real KA topic tree
+        khanacademy.CONTENT_BY_READABLE_ID = {
+            node["readable_id"]: node for node in inputs.nodes() if node.get("readable_id")
+        }
+        return lambda items: [localize(item) for item in items], copy.deepcopy(inputs.assessment_items)
+    return setup
+
+
+def _localize_file_urls(inputs):
+    import ka_sushi_chef
+    return (lambda items: [ka_sushi_chef.localize_file_urls(item["item_data"]) for item in items],
+            list(inputs.localized_items().values()))
+
+
+# stage name -> function returning the callable to benchmark followed by its arguments,
+# given the benchmark inputs
+STAGES = collections.OrderedDict([
+    ("create_paths_remove_orphans_and_empty_topics",
+     lambda inputs: (khanacademy.create_paths_remove_orphans_and_empty_topics, inputs.cleaned_nodes())),
+    ("translate_nodes", lambda inputs: (lambda *args: list(translate_nodes(*args)), inputs.nodes(), inputs.catalog)),
+    ("translate_assessment_item_text", lambda inputs: (lambda *args: list(translate_assessment_item_text(*args)),
+                                                       inputs.assessment_items, inputs.catalog)),
+    ("_build_tree", _build_tree),
+    ("clean_nodes", _clean_nodes),
+    ("localize_image_urls", _localize_items(khanacademy.localize_image_urls)),
+    ("localize_graphie_urls", _localize_items(khanacademy.localize_graphie_urls)),
+    ("localize_content_links", _localize_items(khanacademy.localize_content_links)),
+    ("localize_file_urls", _localize_file_urls),
+])
+
+
+def run_stage(setup, inputs):
+    """
+    Return the wall time in seconds and the peak traced memory in bytes of the stage.
+    """
+    fn, *args = setup(inputs)
+    gc.collect()
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+
+    fn, *args = setup(inputs)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1, help="size relative to the KA topic tree, e.g. 1, 5 or 20")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--items-per-exercise", type=int, default=8)
+    parser.add_argument("--images-per-item", type=int, default=6)
+    parser.add_argument("--stages", help="comma separated stages to run, defaults to all of them")
+    parser.add_argument("--list", action="store_true", help="list the available stages and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(STAGES))
+        return
+
+    # the stages log every untranslated field and skipped node
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stages = args.stages.split(",") if args.stages else list(STAGES)
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error("unknown stages: {}".format(", ".join(sorted(unknown))))
+
+    start = time.perf_counter()
+    inputs = Inputs(args.scale, args.seed, args.items_per_exercise, args.images_per_item)
+    print("Generated {topics} topics, {videos} videos, {exercises} exercises and {items} assessment items in {secs:.1f}s".format(
+        topics=len(inputs.topictree["topics"]),
+        videos=len(inputs.topictree["videos"]),
+        exercises=len(inputs.topictree["exercises"]),
+        items=len(inputs.assessment_items),
+        secs=time.perf_counter() - start,
+    ))
+
+    print("{:<46} {:>10} {:>12}".format("stage", "time (s)", "peak (MiB)"))
+    for name in stages:
+        elapsed, peak = run_stage(STAGES[name], inputs)
+        print("{:<46} {:>10.3f} {:>12.1f}".format(name, elapsed, peak / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
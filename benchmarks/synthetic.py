@@ -0,0 +1,224 @@
+"""
+Seeded generators for synthetic Khan Academy data, for benchmarking the pipeline without
+talking to KA.
+
+make_topictree returns a payload in the same camelCase shape as the KA topictree API
+projection download_and_clean_kalite_data consumes. At scale 1 it has roughly as many
+topics, videos and exercises as the real KA topic tree; scale multiplies that.
+make_assessment_items returns assessment items for the exercises in such a payload,
+with item_data shaped like KA's Perseus items.
+"""
+import json
+import random
+
+ROOT_ID = "x00000000"
+
+# fan-out of each topic level under the root at scale 1: domains, subjects, topics, tutorials
+TOPIC_FANOUT = [10, 8, 6, 5]
+
+VIDEOS_PER_TUTORIAL = 4
+EXERCISES_PER_TUTORIAL = 1.5
+
+# share of content nodes that also appear in a second tutorial
+DUPLICATED_CONTENT = 0.05
+# share of topics that are hidden or deleted
+HIDDEN_TOPICS = 0.02
+
+WORDS = ("add subtract multiply divide fraction decimal equation linear quadratic function graph slope "
+         "triangle circle area volume angle probability statistics mean median cell energy force atom "
+         "molecule reaction history empire revolution economy market supply demand loan interest").split()
+
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def _id(rng):
+    return "x%08x" % rng.getrandbits(32)
+
+
+def _filename(rng):
+    return "%040x" % rng.getrandbits(160)
+
+
+def _topic(rng, slug):
+    return {
+        "childData": [],
+        "deleted": rng.random() < HIDDEN_TOPICS / 2,
+        "description": _words(rng, 12),
+        "doNotPublish": False,
+        "hide": rng.random() < HIDDEN_TOPICS / 2,
+        "id": _id(rng),
+        "kind": "Topic",
+        "slug": slug,
+        "title": _words(rng, 3).title(),
+    }
+
+
+def _video(rng, slug):
+    youtube_id = "".join(rng.choice("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_-") for _ in range(11))
+    return {
+        "description": _words(rng, 20),
+        "descriptionHtml": "<p>{}</p>".format(_words(rng, 20)),
+        "downloadSize": rng.randint(1000000, 50000000),
+        "duration": rng.randint(60, 900),
+        "id": _id(rng),
+        "imageUrl": "https://cdn.kastatic.org/googleusercontent/{}".format(_filename(rng)),
+        "keywords": _words(rng, 5),
+        "kind": "Video",
+        "licenseName": "cc-by-nc-sa",
+        "readableId": slug,
+        "relativeUrl": "/v/{}".format(slug),
+        "sha": _filename(rng),
+        "slug": slug,
+        "title": _words(rng, 4).title(),
+        "translatedYoutubeLang": "en",
+        "youtubeId": youtube_id,
+    }
+
+
+def _exercise(rng, slug, items_per_exercise):
+    return {
+        "allAssessmentItems": [
+            {"id": _id(rng), "live": rng.random() > 0.05, "sha": _filename(rng)}
+            for _ in range(items_per_exercise)
+        ],
+        "curatedRelatedVideos": [],
+        "description": _words(rng, 15),
+        "displayName": _words(rng, 3).title(),
+        "fileName": "{}.html".format(slug),
+        "id": _id(rng),
+        "kind": "Exercise",
+        "name": slug,
+        "prerequisites": [],
+        "slug": slug,
+        "title": _words(rng, 3).title(),
+        "usesAssessmentItems": True,
+    }
+
+
+def make_topictree(scale=1, seed=0, items_per_exercise=8) -> dict:
+    """
+    Return a synthetic topictree payload, with keys "topics", "exercises" and "videos".
+    """
+    rng = random.Random(seed)
+    fanout = TOPIC_FANOUT[:-1] + [max(1, int(round(TOPIC_FANOUT[-1] * scale)))]
+
+    root = _topic(rng, "root")
+    root.update(id=ROOT_ID, hide=True, deleted=False)
+    topics, videos, exercises = [root], [], []
+
+    def add_child(parent, node):
+        parent["childData"].append({"id": node["id"], "kind": node["kind"]})
+
+    level = [root]
+    for count in fanout:
+        next_level = []
+        for parent in level:
+            for i in range(count):
+                # every so often reuse a slug, to exercise slug deduplication
+                slug = "{}-{}".format(_words(rng, 2).replace(" ", "-"), i if rng.random() > 0.01 else 0)
+                topic = _topic(rng, slug)
+                topics.append(topic)
+                add_child(parent, topic)
+                next_level.append(topic)
+        level = next_level
+
+    tutorials = level
+    for tutorial in tutorials:
+        for i in range(VIDEOS_PER_TUTORIAL):
+            video = _video(rng, "{}-video-{}".format(tutorial["slug"], i))
+            videos.append(video)
+            add_child(tutorial, video)
+        for i in range(int(EXERCISES_PER_TUTORIAL + rng.random())):
+            exercise = _exercise(rng, "{}-exercise-{}".format(tutorial["slug"], i), items_per_exercise)
+            exercises.append(exercise)
+            add_child(tutorial, exercise)
+
+    for node in rng.sample(videos + exercises, int((len(videos) + len(exercises)) * DUPLICATED_CONTENT)):
+        add_child(rng.choice(tutorials), node)
+
+    return {"topics": topics, "exercises": exercises, "videos": videos}
+
+
+def make_item_data(rng, num_images=6, content_links=None) -> str:
+    """
+    Return the item_data string of a Perseus item with num_images image and graphie
+    references, and links to any of content_links (KA content slugs).
+    """
+    def image_url():
+        return "https://ka-perseus-images.s3.amazonaws.com/{}.{}".format(_filename(rng), rng.choice(["png", "svg", "jpeg"]))
+
+    def graphie_url():
+        return "web+graphie://ka-perseus-graphie.s3.amazonaws.com/{}".format(_filename(rng))
+
+    content = [_words(rng, 25)]
+    widgets = {}
+    for i in range(num_images):
+        content.append("![]({})".format(graphie_url() if i % 2 else image_url()))
+        widgets["image {}".format(i)] = {
+            "type": "image",
+            "options": {"backgroundImage": {"url": image_url(), "width": 400, "height": 300}},
+        }
+    widgets["numeric-input 1"] = {"type": "numeric-input", "options": {"answers": [{"value": rng.randint(1, 100)}]}}
+    content.append("[[☃ numeric-input 1]]")
+
+    hints = []
+    for _ in range(3):
+        hint = _words(rng, 15)
+        if content_links:
+            hint += " **[Review this](https://www.khanacademy.org/math/algebra/solving-equations/v/{})**".format(
+                rng.choice(content_links))
+        hints.append({"content": hint, "images": {}, "widgets": {}})
+
+    return json.dumps({
+        "question": {"content": "\n\n".join(content), "images": {}, "widgets": widgets},
+        "answerArea": {"calculator": False},
+        "itemDataVersion": {"major": 0, "minor": 1},
+        "hints": hints,
+    })
+
+
+def make_assessment_items(topictree: dict, seed=0, num_images=6) -> list:
+    """
+    Return an assessment item, in the form fetch_assessment_item_data returns, for
+    every assessment item of every exercise in topictree.
+    """
+    rng = random.Random(seed)
+    content_links = [video["readableId"] for video in rng.sample(topictree["videos"], min(100, len(topictree["videos"])))]
+    return [
+        {"id": item["id"], "item_data": make_item_data(rng, num_images, content_links)}
+        for exercise in topictree["exercises"]
+        for item in exercise["allAssessmentItems"]
+    ]
+
+
+def make_catalog(topictree: dict, seed=0, coverage=0.5) -> dict:
+    """
+    Return a msgid -> msgstr mapping translating about coverage of the titles and
+    descriptions in topictree.
+    """
+    rng = random.Random(seed)
+    catalog = {"": ""}
+    for nodes in topictree.values():
+        for node in nodes:
+            for field in ("title", "description", "displayName", "descriptionHtml"):
+                msgid = node.get(field)
+                if msgid and rng.random() < coverage:
+                    catalog[msgid] = msgid.upper()
+    return catalog
+
+
+def make_item_catalog(assessment_items: list, seed=0, coverage=0.9) -> dict:
+    """
+    Return a msgid -> msgstr mapping translating about coverage of the content strings
+    of assessment_items.
+    """
+    rng = random.Random(seed)
+    catalog = {}
+    for item in assessment_items:
+        item_data = json.loads(item["item_data"])
+        for msgid in [item_data["question"]["content"]] + [hint["content"] for hint in item_data["hints"]]:
+            if rng.random() < coverage:
+                catalog[msgid] = msgid.upper()
+    return catalog
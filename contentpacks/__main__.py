@@ -3,6 +3,7 @@ makepack
 
 Usage:
   makecontentpacks ka-lite <lang> <version> [options]
+  makecontentpacks ka-lite-batch <version> <langs>... [options]
   makecontentpacks -h | --help
   makecontentpacks --version
 
@@ -16,60 +17,33 @@ Usage:
 --no-assessment-items          If specified, will omit downloading and including any assessment item data.
 --no-assessment-resources      If specified, will omit downloading and including any resources (images, json files) needed to render assessment item exercises.
 --no-dubbed-videos             If specified, will omit including dubbed video mappings
+--processes=processes          The number of languages ka-lite-batch builds at once. Defaults to one per CPU.
+--delta                        If specified, will only retrieve the assessment items that changed since the last delta build of the language.
+--strict                       If specified, will omit the assessment items with any untranslated content, and the exercises using them.
+
+Each language is built with its sublanguages in pipeline.LANGUAGE_SUBLANG_ARGS, unless
+overridden by the options above. ka-lite-batch builds every one of <langs>, downloading
+the data shared by all languages only once.
 
 """
 from docopt import docopt
 from pathlib import Path
-from contentpacks.khanacademy import retrieve_language_resources, apply_dubbed_video_map, \
-    retrieve_all_assessment_item_data
-from contentpacks.utils import translate_nodes, remove_untranslated_exercises, \
-    remove_assessment_data_with_empty_widgets, remove_nonexistent_assessment_items_from_exercises, \
-    clean_node_data_items
+from contentpacks.pipeline import make_language_pack, build_language_packs, get_sublang_args
 
 import logging
-import pickle
-
-
-def make_language_pack(lang, version, sublangargs, filename, ka_domain, no_assessment_items, no_subtitles, no_assessment_resources, no_dubbed_videos):
-    node_data, subtitle_data, content_catalog = retrieve_language_resources(version, sublangargs, ka_domain, no_subtitles, no_dubbed_videos)
-
-    node_data = translate_nodes(node_data, content_catalog)
-    node_data = list(node_data)
-    node_data, dubbed_video_count = apply_dubbed_video_map(node_data, subtitle_data, sublangargs["video_lang"])
-
-    # now include only the assessment item resources that we need
-    all_assessment_data, all_assessment_files = retrieve_all_assessment_item_data(
-        no_item_data=no_assessment_items,
-        no_item_resources=no_assessment_resources,
-        node_data=node_data,
-        lang=lang,
-        content_catalog=content_catalog,
-    )
-    all_assessment_data = list(remove_assessment_data_with_empty_widgets(all_assessment_data))
-    node_data = remove_nonexistent_assessment_items_from_exercises(node_data, all_assessment_data)
-
-    node_data = clean_node_data_items(node_data)
-    node_data = remove_untranslated_exercises(node_data, all_assessment_data) if lang != "en" else node_data
-    node_data = list(node_data)
-    node_data = sorted(node_data, key=lambda x: x.get('sort_order'))
-
-    with open('node_data_{0}.pickle'.format(lang), 'wb') as handle:
-        pickle.dump(node_data, handle)
-
-    with open('assessment_data_{0}.pickle'.format(lang), 'wb') as handle:
-        pickle.dump(all_assessment_data, handle)
 
 
 def normalize_sublang_args(args):
     """
     Transform the command line arguments we have into something that conforms to the retrieve_language_resources interface.
-    This mostly means using the given lang parameter as the default lang, overridable by the different sublang args.
+    This mostly means using the sublangs the given lang parameter is built with by default, overridable by the different sublang args.
     """
+    sublangs = get_sublang_args(args['<lang>'])
     return {
-        "video_lang": args['--videolang'] or args['<lang>'],
-        "content_lang": args['--contentlang'] or args['<lang>'],
-        "interface_lang": args['--interfacelang'] or args['<lang>'],
-        "subtitle_lang": args['--subtitlelang'] or args['<lang>'],
+        "video_lang": args['--videolang'] or sublangs["video_lang"],
+        "content_lang": args['--contentlang'] or sublangs["content_lang"],
+        "interface_lang": args['--interfacelang'] or sublangs["interface_lang"],
+        "subtitle_lang": args['--subtitlelang'] or sublangs["subtitle_lang"],
     }
 
 
@@ -77,6 +51,9 @@ def main():
     import os
     args = docopt(__doc__)
 
+    if args["ka-lite-batch"]:
+        return batch_main(args)
+
     assert args["ka-lite"], ("Sorry, content packs for non-KA Lite "
                              "software aren't implemented yet.")
     del args["ka-lite"]
@@ -93,13 +70,16 @@ def main():
     no_assessment_resources = args['--no-assessment-resources']
     no_subtitles = args['--no-subtitles']
     no_dubbed_videos = args['--no-dubbed-videos']
+    delta = args['--delta']
+    strict = args['--strict']
 
     # log_file = args["--logging"] or "debug.log"
 
     logging.basicConfig(level=logging.INFO)
 
     try:
-        make_language_pack(lang, version, sublangs, out, ka_domain, no_assessment_items, no_subtitles, no_assessment_resources, no_dubbed_videos)
+        make_language_pack(lang, version, sublangs, out, ka_domain, no_assessment_items, no_subtitles, no_assessment_resources, no_dubbed_videos,
+                           delta=delta, strict=strict)
     except Exception as e:           # This is allowed, since we want to potentially debug all errors
         import os
         if not os.environ.get("DEBUG"):
@@ -111,5 +91,28 @@ def main():
             # raise
 
 
+def batch_main(args):
+    import os
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+
+    failed = build_language_packs(
+        args["<langs>"],
+        processes=int(args["--processes"]) if args["--processes"] else None,
+        version=args["<version>"],
+        ka_domain=os.environ.get("KA_DOMAIN") or "www.khanacademy.org",
+        no_assessment_items=args["--no-assessment-items"],
+        no_subtitles=args["--no-subtitles"],
+        no_assessment_resources=args["--no-assessment-resources"],
+        no_dubbed_videos=args["--no-dubbed-videos"],
+        delta=args["--delta"],
+        strict=args["--strict"],
+    )
+    if failed:
+        logging.error("Failed to build language packs for: {}".format(", ".join(failed)))
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,288 @@
+"""
+The build cache behind contentpacks.utils.cache_file.
+
+Every file a cache_file function downloads is stored once, under the sha256 of its
+contents, in the cache directory's OBJECTS_DIR, and hard linked (or copied, where the
+file system can't link) to the path the caller asked for. A SQLite manifest in the
+cache directory maps each request key (the function, its url and arguments, and the
+filename) to the hash of the file it produced, along with the file's size, when it was
+created and last used, and the HTTP validators it was served with.
+
+Files are checked against the manifest when they're read: a file whose size or mtime
+has changed since it was stored is rehashed, and re-downloaded if its contents changed.
+Once the files in the cache add up to more than CACHE_MAX_BYTES, the least recently
+used ones are removed, except for those used by the current build.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import json
+
+# The size in bytes the cache is trimmed down to once it grows past it.
+CACHE_MAX_BYTES = int(os.environ.get("CONTENTPACKS_CACHE_MAX_BYTES", 20 * 2 ** 30))
+
+MANIFEST_FILENAME = ".manifest.sqlite3"
+OBJECTS_DIR = ".objects"
+
+HASH_CHUNK_SIZE = 2 ** 20
+
+# entries used since this process started are never evicted, since the build that's
+# running may still read them
+_SESSION_START = time.time()
+
+SCHEMA = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS objects (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL REFERENCES objects (sha256),
+    mtime_ns INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    validators TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_sha256 ON entries (sha256);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+-- the total size of the objects, kept up to date by triggers so it never has to be summed
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM objects;
+CREATE TRIGGER IF NOT EXISTS objects_insert AFTER INSERT ON objects BEGIN
+    UPDATE totals SET size = size + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS objects_delete AFTER DELETE ON objects BEGIN
+    UPDATE totals SET size = size - OLD.size WHERE id = 0;
+END;
+COMMIT;
+"""
+
+
+def hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def request_key(func, url: str, filename: str, kwargs: dict) -> str:
+    """
+    Return the manifest key of a call to the cache_file function func.
+    """
+    return "\t".join([
+        "{}.{}".format(func.__module__, func.__qualname__),
+        url,
+        filename,
+        json.dumps(kwargs, sort_keys=True, default=str),
+    ])
+
+
+class BuildCache:
+    """
+    The manifest and object store of one cache directory. Safe to use from several
+    threads and processes at once.
+    """
+
+    def __init__(self, cachedir: str, max_bytes: int=None):
+        self.cachedir = cachedir
+        self.objects_dir = os.path.join(cachedir, OBJECTS_DIR)
+        self.max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._local = threading.local()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        with self._db() as db:
+            db.executescript(SCHEMA)
+
+    def _db(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads, or carried over a fork
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(os.path.join(self.cachedir, MANIFEST_FILENAME), timeout=60)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256[:2], sha256)
+
+    def staging_path(self, path: str) -> str:
+        """
+        Return a new, empty file next to path for a download to be written to.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, staging_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".",
+                                            suffix=".download")
+        os.close(fd)
+        return staging_path
+
+    def lookup(self, key: str, path: str):
+        """
+        Return whether the file stored for key is intact at path, restoring it from the
+        object store if it's gone missing there. Returns None if nothing is stored for key.
+        """
+        db = self._db()
+        row = db.execute("SELECT path, sha256, mtime_ns FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        stored_path, sha256, mtime_ns = row
+        size = db.execute("SELECT size FROM objects WHERE sha256 = ?", (sha256,)).fetchone()[0]
+
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        intact = path == stored_path and st is not None and st.st_size == size and st.st_mtime_ns == mtime_ns
+        if not intact and st is not None and st.st_size == size and hash_file(path) == sha256:
+            intact = True
+        if not intact:
+            # the file at path was modified or removed, fall back to the stored copy
+            object_path = self.object_path(sha256)
+            if os.path.exists(object_path) and hash_file(object_path) == sha256:
+                self._materialize(object_path, path)
+                intact = True
+            else:
+                logging.warning("Cached file {} is corrupt, downloading it again".format(path))
+                with db:
+                    db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._remove_object_if_unused(db, sha256)
+                return False
+
+        with db:
+            db.execute("UPDATE entries SET path = ?, mtime_ns = ?, accessed = ? WHERE key = ?",
+                       (path, os.stat(path).st_mtime_ns, time.time(), key))
+        return True
+
+    def store(self, key: str, staging_path: str, path: str, validators: dict=None):
+        """
+        Move the file downloaded to staging_path into the object store, make it
+        available at path and record it under key. Evicts old entries if the cache has
+        grown too big.
+        """
+        sha256 = hash_file(staging_path)
+        size = os.path.getsize(staging_path)
+        object_path = self.object_path(sha256)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        if os.path.exists(object_path):
+            os.remove(staging_path)
+        else:
+            os.replace(staging_path, object_path)
+        self._materialize(object_path, path)
+
+        db = self._db()
+        now = time.time()
+        with db:
+            old = db.execute("SELECT sha256 FROM entries WHERE key = ?", (key,)).fetchone()
+            db.execute("INSERT OR IGNORE INTO objects (sha256, size) VALUES (?, ?)", (sha256, size))
+            db.execute("INSERT OR REPLACE INTO entries (key, path, sha256, mtime_ns, created, accessed, validators) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (key, path, sha256, os.stat(path).st_mtime_ns, now, now,
+                        json.dumps(validators) if validators else None))
+            if old and old[0] != sha256:
+                self._remove_object_if_unused(db, old[0])
+
+        self.evict()
+
+    def adopt(self, key: str, path: str):
+        """
+        Record a file downloaded to path before the cache had a manifest.
+        """
+        staging_path = self.staging_path(path)
+        shutil.copyfile(path, staging_path)
+        self.store(key, staging_path, path)
+
+    def validators(self, key: str) -> dict:
+        """
+        Return the HTTP validators the file stored for key was served with.
+        """
+        row = self._db().execute("SELECT validators FROM entries WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def size(self) -> int:
+        return self._db().execute("SELECT size FROM totals WHERE id = 0").fetchone()[0]
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes.
+        """
+        db = self._db()
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+
+        evicted = 0
+        rows = db.execute("SELECT key, path, sha256 FROM entries WHERE accessed < ? ORDER BY accessed",
+                          (_SESSION_START,)).fetchall()
+        for key, path, sha256 in rows:
+            if excess <= 0:
+                break
+            # only remove the file at path if it's still the one the entry stored
+            try:
+                if os.path.samefile(path, self.object_path(sha256)) or hash_file(path) == sha256:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+            with db:
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                excess -= self._remove_object_if_unused(db, sha256)
+            evicted += 1
+
+        logging.info("Evicted {} files from the build cache in {}".format(evicted, self.cachedir))
+
+    def _remove_object_if_unused(self, db, sha256) -> int:
+        """
+        Remove the object sha256 if no entry refers to it any more, and return the
+        number of bytes freed.
+        """
+        if db.execute("SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone():
+            return 0
+        row = db.execute("SELECT size FROM objects WHERE sha256 = ?", (sha256,)).fetchone()
+        db.execute("DELETE FROM objects WHERE sha256 = ?", (sha256,))
+        try:
+            os.remove(self.object_path(sha256))
+        except FileNotFoundError:
+            pass
+        return row[0] if row else 0
+
+    def _materialize(self, object_path, path):
+        # link to a temporary name first, so readers never see a half written file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the name is unique to this thread of this process, as forked processes share thread idents
+        tmp_path = "{}.{}.{}.link".format(path, os.getpid(), threading.get_ident())
+        try:
+            os.link(object_path, tmp_path)
+        except FileExistsError:
+            # left behind by a process that died, and had the same pid
+            os.remove(tmp_path)
+            os.link(object_path, tmp_path)
+        except OSError:
+            # the file system can't hard link; tmp_path doesn't exist, so the copy
+            # can't write through a link into the object
+            shutil.copyfile(object_path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_cache(cachedir: str) -> BuildCache:
+    """
+    Return the BuildCache for cachedir, shared by everything in the process.
+    """
+    with _CACHES_LOCK:
+        if cachedir not in _CACHES:
+            _CACHES[cachedir] = BuildCache(cachedir)
+        return _CACHES[cachedir]
@@ -0,0 +1,166 @@
+"""
+Compiled translation catalogs, cached across runs.
+
+Building a Catalog means parsing every po file of a CrowdIn zip, so the result is
+compiled into a file under build/catalogs/, named after the sha256 of the zip it was
+built from, and later runs given the same zip open that file instead. A compiled
+catalog is hash indexed, like a GNU MO file, and memory mapped: opening one reads
+nothing but its header, and a lookup reads one hash slot, one entry and the strings
+it points to.
+
+The file is laid out as, all integers little endian uint32:
+
+- a header: MAGIC, the number of strings n, the number of hash slots m
+- n entries of (msgid offset, msgid length, msgstr offset, msgstr length), sorted by msgid
+- m hash slots, each 0 or the index of an entry plus one, probed linearly from
+  crc32(msgid) mod m
+- the utf-8 encoded msgids and msgstrs the entries point to
+"""
+import collections.abc
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from contentpacks.utils import build_catalog
+
+CATALOG_DIR = "catalogs"
+
+MAGIC = b"KACATLG1"
+
+_HEADER = struct.Struct("<8sII")
+_ENTRY = struct.Struct("<IIII")
+_SLOT = struct.Struct("<I")
+
+
+def _hash_size(count: int) -> int:
+    # a power of two at least twice the number of strings, so probes stay short
+    size = 1
+    while size < count * 2:
+        size *= 2
+    return size
+
+
+def compile_catalog(catalog: dict, path: str):
+    """
+    Write catalog to path as a compiled catalog.
+    """
+    msgids = sorted(catalog)
+    hash_size = _hash_size(len(msgids))
+    entries_offset = _HEADER.size
+    slots_offset = entries_offset + _ENTRY.size * len(msgids)
+    data_offset = slots_offset + _SLOT.size * hash_size
+
+    entries = bytearray()
+    slots = [0] * hash_size
+    data = bytearray()
+    for index, msgid in enumerate(msgids):
+        msgid_bytes = msgid.encode("utf-8")
+        msgstr_bytes = catalog[msgid].encode("utf-8")
+        msgid_offset = data_offset + len(data)
+        data += msgid_bytes
+        msgstr_offset = data_offset + len(data)
+        data += msgstr_bytes
+        entries += _ENTRY.pack(msgid_offset, len(msgid_bytes), msgstr_offset, len(msgstr_bytes))
+
+        slot = zlib.crc32(msgid_bytes) % hash_size
+        while slots[slot]:
+            slot = (slot + 1) % hash_size
+        slots[slot] = index + 1
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # several languages' builds can compile the same catalog at once
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, len(msgids), hash_size))
+        f.write(entries)
+        f.write(struct.pack("<{}I".format(hash_size), *slots))
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class CompiledCatalog(collections.abc.Mapping):
+    """
+    Read-only, dict-like view over a catalog written by compile_catalog, usable wherever
+    a Catalog is. Strings are decoded when they're looked up. Iterates over msgids in
+    sorted order.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self._hash_size = (_HEADER.unpack_from(self._data, 0) if len(self._data) >= _HEADER.size
+                                               else (None, 0, 0))
+        self._slots_offset = _HEADER.size + _ENTRY.size * self._count
+        if magic != MAGIC or len(self._data) < self._slots_offset + _SLOT.size * self._hash_size:
+            self._data.close()
+            raise ValueError("{} isn't a compiled catalog".format(path))
+
+    def _entry(self, index: int):
+        return _ENTRY.unpack_from(self._data, _HEADER.size + _ENTRY.size * index)
+
+    def __getitem__(self, msgid):
+        if not isinstance(msgid, str):
+            raise KeyError(msgid)
+        msgid_bytes = msgid.encode("utf-8")
+        slot = zlib.crc32(msgid_bytes) % self._hash_size
+        while True:
+            index, = _SLOT.unpack_from(self._data, self._slots_offset + _SLOT.size * slot)
+            if not index:
+                raise KeyError(msgid)
+            msgid_offset, msgid_length, msgstr_offset, msgstr_length = self._entry(index - 1)
+            if self._data[msgid_offset:msgid_offset + msgid_length] == msgid_bytes:
+                return self._data[msgstr_offset:msgstr_offset + msgstr_length].decode("utf-8")
+            slot = (slot + 1) % self._hash_size
+
+    def __iter__(self):
+        for index in range(self._count):
+            msgid_offset, msgid_length, _, _ = self._entry(index)
+            yield self._data[msgid_offset:msgid_offset + msgid_length].decode("utf-8")
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._data.close()
+
+    def __getstate__(self):
+        # pickled as just the path, so catalogs can be handed to worker processes
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+
+def compiled_catalog_path(zip_path: str, includes: str, cachedir: str=None) -> str:
+    """
+    Return the path of the compiled catalog of the po files matching includes in the
+    zip file at zip_path.
+    """
+    cachedir = cachedir or os.path.join(os.getcwd(), "build")
+    sha256 = hashlib.sha256(includes.encode("utf-8") + b"\0")
+    with open(zip_path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            sha256.update(chunk)
+    return os.path.join(cachedir, CATALOG_DIR, "{}.catalog".format(sha256.hexdigest()))
+
+
+def load_catalog(zip_path: str, includes: str="*.po", cachedir: str=None) -> CompiledCatalog:
+    """
+    Return the catalog of the po files matching includes in the zip file at zip_path,
+    compiling it first if it hasn't been compiled from this zip before.
+    """
+    path = compiled_catalog_path(zip_path, includes, cachedir)
+    if os.path.exists(path):
+        try:
+            return CompiledCatalog(path)
+        except ValueError:
+            logging.warning("Recompiling corrupt catalog {}".format(path))
+    else:
+        logging.info("Compiling the catalog of {}".format(zip_path))
+
+    compile_catalog(build_catalog(zip_path, includes), path)
+    return CompiledCatalog(path)
@@ -0,0 +1,517 @@
+"""
+The HTTP layer used by everything that talks to Khan Academy, CrowdIn and Google Sheets.
+
+All requests go through one shared session, which keeps connections alive between
+requests, and across language packs when several are built in the same process.
+request() and get() add the same failure handling to every call site:
+
+- requests that fail with a connection error or a retryable status (RETRY_STATUSES)
+  are retried with exponential backoff and full jitter, or after the delay given by
+  the server's Retry-After header
+- requests time out after CONNECT_TIMEOUT seconds without a connection, or
+  READ_TIMEOUT seconds without data, unless they're given a timeout of their own
+- requests to each host are rate limited with a token bucket, shared out between the
+  processes building language packs together (see share_rate_limits)
+- once CIRCUIT_FAILURE_THRESHOLD requests in a row to a host have failed, the circuit
+  for that host opens, and no requests are sent to it for CIRCUIT_COOLDOWN seconds
+"""
+import base64
+import email.utils
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from contentpacks import replay
+
+# How many requests fetch_all makes at once.
+FETCH_CONCURRENCY = int(os.environ.get("CONTENTPACKS_FETCH_CONCURRENCY", 32))
+
+# How many connections the session keeps open to a single host. Requests to a host
+# with all its connections busy wait for one to free up.
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get("CONTENTPACKS_MAX_CONNECTIONS_PER_HOST", 16))
+
+# How many hosts the session keeps connection pools for.
+MAX_POOLED_HOSTS = 20
+
+# How many times a request is attempted before giving up, and the bounds in seconds of
+# the delay between attempts.
+MAX_ATTEMPTS = int(os.environ.get("CONTENTPACKS_HTTP_MAX_ATTEMPTS", 8))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 120.0
+
+RETRY_STATUSES = frozenset([408, 429, 500, 502, 503, 504])
+
+# Seconds to wait for a connection to a host, and for the next data of a response,
+# before a request fails with a timeout and is retried.
+CONNECT_TIMEOUT = float(os.environ.get("CONTENTPACKS_HTTP_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("CONTENTPACKS_HTTP_READ_TIMEOUT", 60))
+
+# Sustained requests per second allowed to a single host, and how many requests can be
+# made in a burst above that rate.
+RATE_LIMIT = float(os.environ.get("CONTENTPACKS_HTTP_RATE_LIMIT", 50))
+RATE_LIMIT_BURST = 100
+
+CIRCUIT_FAILURE_THRESHOLD = 20
+CIRCUIT_COOLDOWN = 60.0
+
+# How many bytes of a download are read and written at a time.
+DOWNLOAD_CHUNK_SIZE = 2 ** 20
+
+
+class CircuitOpenError(requests.RequestException):
+    """
+    Raised when a request gives up because too many requests to its host failed.
+    """
+    pass
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, refilled at rate tokens per second up to capacity.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting for one to be available if needed.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failed requests to a host. Once there are failure_threshold of
+    them the circuit opens for cooldown seconds; after that a single request is let
+    through, which closes the circuit if it succeeds or reopens it if it fails.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        """
+        Return 0 if a request may be sent now, or how many seconds until the circuit
+        lets one through.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self._trial_in_flight:
+                return self.cooldown
+            self._trial_in_flight = True
+            return 0
+
+    def cancel(self):
+        """
+        Forget about a request that failed for reasons that have nothing to do with its host.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, succeeded: bool):
+        with self._lock:
+            self._trial_in_flight = False
+            if succeeded:
+                self._failures = 0
+                self._opened_at = None
+            else:
+                self._failures += 1
+                if self._failures >= self.failure_threshold:
+                    if self._opened_at is None:
+                        logging.warning("Too many failed requests in a row, pausing requests to this host for {}s".format(self.cooldown))
+                    self._opened_at = time.monotonic()
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+# how many processes the per-host rate limits are shared out between
+_rate_limit_share = 1
+
+
+def share_rate_limits(processes: int):
+    """
+    Limit this process to its share of the per-host rate limits, when processes
+    processes make requests at once, e.g. the workers of a pool. Called in each of them.
+    """
+    global _rate_limit_share
+    with _hosts_lock:
+        _rate_limit_share = processes
+        _hosts.clear()
+
+
+def _get_host_limits(url: str) -> (TokenBucket, CircuitBreaker):
+    host = urlparse(url).netloc
+    with _hosts_lock:
+        if host not in _hosts:
+            _hosts[host] = (TokenBucket(RATE_LIMIT / _rate_limit_share, max(1, RATE_LIMIT_BURST // _rate_limit_share)),
+                            CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN))
+        return _hosts[host]
+
+
+def _retry_after(response: requests.Response) -> float:
+    """
+    Return the delay in seconds asked for by the response's Retry-After header, if any.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Return how long to wait after the given failed attempt (counting from 1): a random
+    delay up to an exponentially growing, capped bound.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Return the session for this process, creating it on first use. A process forked
+    from one that already had a session gets its own, so connections are never shared
+    between processes.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_POOLED_HOSTS, pool_maxsize=MAX_CONNECTIONS_PER_HOST,
+                                  pool_block=True)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            # record or replay the responses, if CONTENTPACKS_HTTP_MODE says so
+            replay.install(_session)
+            _session_pid = os.getpid()
+        return _session
+
+
+def request(method: str, url: str, max_attempts: int=None, **kwargs) -> requests.Response:
+    """
+    Make a request through the shared session, retrying failures as described in the
+    module docstring, and return its response. Keyword arguments are passed on to
+    requests, with a timeout of (CONNECT_TIMEOUT, READ_TIMEOUT) unless they include one.
+
+    Responses with a status that isn't worth retrying, including errors like 404, are
+    returned as they are, so callers still need to check the status. Once max_attempts
+    (MAX_ATTEMPTS by default) have failed, the last error is raised as a
+    requests.RequestException.
+    """
+    max_attempts = max_attempts or MAX_ATTEMPTS
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    bucket, circuit = _get_host_limits(url)
+
+    attempt = 0
+    while True:
+        attempt += 1
+
+        wait = circuit.wait_time()
+        if wait:
+            if attempt >= max_attempts:
+                raise CircuitOpenError("Gave up on {url}: too many failed requests to its host".format(url=url))
+            time.sleep(min(wait, BACKOFF_MAX))
+            continue
+
+        bucket.acquire()
+        delay = None
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            circuit.record(False)
+            if attempt >= max_attempts:
+                raise
+            logging.warning("Attempt {attempt}: got error requesting {url}: {e!s:<80}".format(attempt=attempt, url=url, e=e))
+        except Exception:
+            circuit.cancel()
+            raise
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                circuit.record(True)
+                return response
+            circuit.record(False)
+            if attempt >= max_attempts:
+                response.raise_for_status()
+                return response
+            logging.warning("Attempt {attempt}: got status {status} requesting {url}".format(
+                attempt=attempt, status=response.status_code, url=url))
+            delay = _retry_after(response)
+            response.close()
+
+        time.sleep(min(delay, BACKOFF_MAX) if delay is not None else backoff_delay(attempt))
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """
+    Make a GET request with request().
+    """
+    return request("GET", url, **kwargs)
+
+
+def conditional_headers(validators: dict) -> dict:
+    """
+    Return the headers making a request conditional on the validators returned by
+    response_validators for an earlier response.
+    """
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+    return headers
+
+
+def response_validators(response: requests.Response) -> dict:
+    """
+    Return the ETag and Last-Modified headers of response.
+    """
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+class DownloadError(requests.RequestException):
+    """
+    Raised when a download doesn't give a usable file, e.g. when it doesn't match its
+    checksum.
+    """
+    pass
+
+
+def _part_validators(part_path: str) -> dict:
+    try:
+        with open(part_path + ".json", "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _expected_size(response: requests.Response, offset: int) -> int:
+    # the size of a compressed body isn't known until it's been decompressed
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    if response.status_code == 206:
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    return offset + int(length) if length and length.isdigit() else None
+
+
+def _file_digest(path: str, algorithm: str) -> bytes:
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def download(url: str, path: str, headers: dict=None, validators: dict=None, sha256: str=None,
+             max_attempts: int=None) -> dict:
+    """
+    Download url to path, and return the response's validators, or None if the server
+    answered the conditional request made with validators with a 304.
+
+    The body is written in DOWNLOAD_CHUNK_SIZE chunks to a partial file next to path,
+    which is only moved to path once it's complete, and has been checked against the
+    response's Content-MD5 and against sha256, if either is given. If the download is
+    interrupted, it's resumed after the last whole chunk written with a Range request,
+    either straight away or, if it failed max_attempts times, by the next download of url.
+    Partial files that can't be resumed are removed.
+    """
+    max_attempts = max_attempts or MAX_ATTEMPTS
+    part_path, part, resumable = _open_part(url, path)
+    with part:
+        try:
+            received = _receive(url, part, part_path, headers, validators, max_attempts)
+            if received is not None:
+                _check_digests(part_path, url, received["content_md5"], sha256)
+                os.replace(part_path, path)
+        finally:
+            # still holding the lock on the partial file, so no other download is using it
+            _remove_part(part_path, keep_partial=resumable)
+
+    if received is None:
+        return None
+    return {"etag": received["etag"], "last_modified": received["last_modified"]}
+
+
+def _open_part(url: str, path: str):
+    """
+    Open the partial file url is downloaded to for appending, locking it. Returns its
+    path, the open file, and whether later downloads of url can resume it.
+    """
+    part_path = os.path.join(os.path.dirname(path), ".{}.part".format(hashlib.sha1(url.encode("utf-8")).hexdigest()))
+    part = open(part_path, "ab")
+    try:
+        fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        # another process is downloading url, so download a copy of our own
+        part.close()
+        part_path = "{}.{}".format(part_path, os.getpid())
+        return part_path, open(part_path, "wb"), False
+    return part_path, part, True
+
+
+def _remove_part(part_path: str, keep_partial: bool):
+    """
+    Remove the partial file at part_path and its validators, unless keep_partial and
+    it holds part of the file, for a later download to resume.
+    """
+    if keep_partial and os.path.exists(part_path) and os.path.getsize(part_path):
+        return
+    for leftover in (part_path, part_path + ".json"):
+        try:
+            os.remove(leftover)
+        except FileNotFoundError:
+            pass
+
+
+def _range_headers(part, part_path: str, headers: dict, validators: dict) -> (int, dict):
+    """
+    Return the offset to download from and the headers to send, resuming the partial
+    file part if it can be, and otherwise making the request conditional on validators.
+    """
+    offset = part.seek(0, os.SEEK_END)
+    part_validators = _part_validators(part_path)
+    # If-Range needs a strong ETag
+    etag = part_validators.get("etag")
+    if_range = etag if etag and not etag.startswith("W/") else part_validators.get("last_modified")
+
+    request_headers = dict(headers or {})
+    if offset and if_range:
+        # ranges of a compressed body can't be appended to the decompressed part
+        request_headers.update({"Range": "bytes={}-".format(offset), "If-Range": if_range,
+                                "Accept-Encoding": "identity"})
+        return offset, request_headers
+    request_headers.update(conditional_headers(validators or {}))
+    return 0, request_headers
+
+
+def _receive(url: str, part, part_path: str, headers: dict, validators: dict, max_attempts: int) -> dict:
+    """
+    Download url into the partial file part, retrying interruptions. Returns None on
+    a 304, and otherwise the validators and Content-MD5 of the file.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        offset, request_headers = _range_headers(part, part_path, headers, validators)
+        response = get(url, stream=True, headers=request_headers, max_attempts=max_attempts)
+        try:
+            if response.status_code == 304:
+                return None
+            if response.status_code == 416 and attempt < max_attempts:
+                # the part is no longer a prefix of the file
+                part.truncate(0)
+                continue
+            response.raise_for_status()
+            return _write_part(response, part, part_path, offset)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            part.flush()
+            if attempt >= max_attempts:
+                raise
+            logging.warning("Attempt {attempt}: download of {url} interrupted after {size} bytes, resuming: {e}".format(
+                attempt=attempt, url=url, size=part.tell(), e=e))
+            time.sleep(backoff_delay(attempt))
+        finally:
+            response.close()
+
+
+def _write_part(response: requests.Response, part, part_path: str, offset: int) -> dict:
+    """
+    Write the body of response to the partial file part from offset, starting it
+    over unless response is a 206.
+    """
+    if response.status_code != 206:
+        offset = 0
+        part.seek(0)
+        part.truncate()
+        with open(part_path + ".json", "w") as f:
+            json.dump(response_validators(response), f)
+    expected_size = _expected_size(response, offset)
+
+    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+        part.write(chunk)
+    part.flush()
+    if expected_size is not None and part.tell() != expected_size:
+        raise requests.ConnectionError("Got {} of {} bytes".format(part.tell(), expected_size))
+
+    part_validators = _part_validators(part_path)
+    return {
+        "etag": part_validators.get("etag"),
+        "last_modified": part_validators.get("last_modified"),
+        "content_md5": response.headers.get("Content-MD5") if response.status_code == 200 else None,
+    }
+
+
+def _check_digests(part_path: str, url: str, content_md5: str, sha256: str):
+    """
+    Check the partial file at part_path against content_md5 and sha256, removing it
+    if it doesn't match either.
+    """
+    checks = []
+    if content_md5:
+        checks.append(("md5", base64.b64decode(content_md5)))
+    if sha256:
+        checks.append(("sha256", bytes.fromhex(sha256)))
+    for algorithm, digest in checks:
+        if _file_digest(part_path, algorithm) != digest:
+            os.remove(part_path)
+            raise DownloadError("The {} of the file downloaded from {} doesn't match".format(algorithm, url))
+
+
+def fetch_all(fn, items, concurrency: int=None):
+    """
+    Call fn on each of items, and yield the results in the order of items as they
+    come in.
+
+    The calls run on a pool of concurrency threads (FETCH_CONCURRENCY by default).
+    fn is expected to make its requests through get_session(), so all calls share its
+    pooled keep-alive connections and its per-host connection limit.
+    """
+    with ThreadPoolExecutor(concurrency or FETCH_CONCURRENCY) as executor:
+        yield from executor.map(fn, items)
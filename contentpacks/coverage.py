@@ -0,0 +1,104 @@
+"""
+Predict which exercises of a language pack won't make it into the pack, before their
+assessment items are fetched.
+
+A non-English pack only keeps the exercises that use assessment items. The items that
+don't make it into the assessment store are removed from their exercises (see
+remove_nonexistent_assessment_items_from_exercises), and the exercises left without
+any items are dropped. So an exercise is sure to be dropped if it doesn't use
+assessment items, or if none of its items will make it, and fetching, translating and
+localizing its items, and downloading their images, is wasted. The coverage index
+looks at the items already in the item store, and tells which of them will be dropped:
+those without question content or widgets and, in strict mode, those with content the
+catalog doesn't translate. The items used only by exercises that are sure to be
+dropped don't need to be fetched.
+
+Items that aren't in the item store yet, or only for another sha, are assumed to make it.
+"""
+import collections
+import logging
+
+import ujson
+
+from contentpacks.itemstore import get_item_store
+from contentpacks.utils import NodeType, smart_translate_item_data
+
+
+def content_strings(item_data: dict) -> list:
+    """
+    Return the content strings of parsed assessment item data, the ones
+    smart_translate_item_data translates.
+    """
+    strings = []
+
+    def collect(s):
+        strings.append(s)
+        return s
+
+    smart_translate_item_data(item_data, collect)
+    return strings
+
+
+def will_be_kept(item: dict, catalog, strict: bool=False) -> bool:
+    """
+    Return whether the assessment item will make it into the assessment store of a
+    language pack translated through catalog.
+    """
+    try:
+        item_data = ujson.loads(item["item_data"])
+        question = item_data["question"]
+    except (KeyError, TypeError, ValueError):
+        return False
+    if not question.get("content") or not question.get("widgets"):
+        return False
+    if strict:
+        return all(catalog.get(s) for s in content_strings(item_data) if s)
+    return True
+
+
+class CoverageIndex:
+    """
+    What's known, before the fetch, about the assessment items and exercises of
+    node_data in lang. item_status maps item ids to True if the item will be kept,
+    False if it will be dropped, and None if it isn't in the item store.
+    """
+
+    def __init__(self, node_data: list, catalog, lang: str, strict: bool=False, item_store=None):
+        item_store = item_store or get_item_store()
+        self.exercises = collections.OrderedDict()
+        self.item_status = {}
+        for node in node_data:
+            if node.get("kind") != NodeType.exercise:
+                continue
+            items = node.get("all_assessment_items", [])
+            item_ids = [item["id"] for item in items]
+            self.exercises[node["id"]] = (node.get("uses_assessment_items"), item_ids)
+            for item_id, sha in zip(item_ids, (item.get("sha") for item in items)):
+                if item_id not in self.item_status:
+                    item = item_store.get(item_id, lang, sha=sha)
+                    self.item_status[item_id] = None if item is None else will_be_kept(item, catalog, strict)
+
+    def dropped_exercises(self) -> set:
+        """
+        Return the ids of the exercises that will be dropped whatever is fetched: those
+        that don't use assessment items, and those none of whose items will be kept.
+        """
+        return {exercise_id for exercise_id, (uses_assessment_items, item_ids) in self.exercises.items()
+                if not uses_assessment_items or all(self.item_status[item_id] is False for item_id in item_ids)}
+
+    def skipped_items(self) -> set:
+        """
+        Return the ids of the items that don't need to be fetched, as every exercise
+        using them will be dropped.
+        """
+        dropped = self.dropped_exercises()
+        needed = {item_id for exercise_id, (_, item_ids) in self.exercises.items() if exercise_id not in dropped
+                  for item_id in item_ids}
+        return self.item_status.keys() - needed
+
+    def log_summary(self, lang: str):
+        statuses = collections.Counter(self.item_status.values())
+        logging.info("{lang}: {kept} assessment items will be kept and {dropped} dropped, {unknown} aren't cached yet".format(
+            lang=lang, kept=statuses[True], dropped=statuses[False], unknown=statuses[None]))
+        logging.info("{lang}: {dropped} of {total} exercises will be dropped, skipping {skipped} assessment items".format(
+            lang=lang, dropped=len(self.dropped_exercises()), total=len(self.exercises), skipped=len(self.skipped_items())))
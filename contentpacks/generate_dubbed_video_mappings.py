@@ -6,11 +6,11 @@ import logging
 import os
 import requests
 import sys
-import time
-import urllib
 
 from io import StringIO
 
+from contentpacks import client
+
 
 PROJECT_PATH = os.path.join(os.getcwd())
 CACHE_FILEPATH = os.path.join(PROJECT_PATH, "build", "csv", 'dubbed_videos.csv')
@@ -45,10 +45,13 @@ def download_ka_dubbed_video_csv(download_url=None, is_khan_csv=False, cache_fil
     if not download_url:
         csv_url = "http://learningequality.org/r/translationmapping"
         if is_khan_csv:
-            csv_url = "http://www.khanacademy.org/r/translationmapping"
+            csv_url = "http://{ka_domain}/r/translationmapping".format(ka_domain=os.environ.get("KA_DOMAIN") or "www.khanacademy.org")
         logging.info("Getting spreadsheet location from (%s)" % csv_url)
         try:
-            download_url = urllib.request.urlopen(csv_url).geturl()
+            # only the url we get redirected to is needed, so don't read the body
+            redirect = client.get(csv_url, stream=True)
+            redirect.close()
+            download_url = redirect.url
             if "docs.google.com" not in download_url:
                 logging.warn("Redirect location no longer in Google docs (%s)" % download_url)
             else:
@@ -59,12 +62,7 @@ def download_ka_dubbed_video_csv(download_url=None, is_khan_csv=False, cache_fil
 
     logging.info("Downloading dubbed video data from %s" % download_url)
 
-    data = requests.get(download_url)
-    attempts = 1
-    while data.status_code != 200 and attempts <= 100:
-        time.sleep(30)
-        data = requests.get(download_url)
-        attempts += 1
+    data = client.get(download_url)
 
     if data.status_code != 200:
         raise requests.RequestException("Failed to download dubbed video CSV data: %s" % data.content)
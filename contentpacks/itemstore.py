@@ -0,0 +1,148 @@
+"""
+The store of raw assessment item data downloaded from KA, shared by all languages.
+
+Items are kept in a single SQLite database in the cache directory, keyed by item id
+and language, instead of one JSON file per item. Items added from the download threads
+are buffered and inserted in batches of INSERT_BATCH_SIZE, in one transaction each.
+Items are encoded and decoded with the json module rather than ujson, which rounds floats.
+Each item is stored with the KA sha it was downloaded for, if known, so a copy of an
+item that has since changed on KA isn't mistaken for the current one.
+"""
+import logging
+import os
+import sqlite3
+import json
+import threading
+
+STORE_FILENAME = "assessment_items.sqlite3"
+
+# the directory items were cached in, one JSON file per item, before this store
+LEGACY_DIRNAME = "assessment_items"
+
+INSERT_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT NOT NULL,
+    lang TEXT NOT NULL,
+    data TEXT NOT NULL,
+    sha TEXT,
+    PRIMARY KEY (id, lang)
+) WITHOUT ROWID;
+"""
+
+
+class AssessmentItemStore:
+    """
+    Assessment item data keyed by (item id, language). A language of None stands for
+    the items KA serves without a lang parameter. Safe to use from several threads
+    and processes at once.
+    """
+
+    def __init__(self, cachedir: str):
+        self.cachedir = cachedir
+        self.path = os.path.join(cachedir, STORE_FILENAME)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._db = None
+        self._pid = None
+        os.makedirs(cachedir, exist_ok=True)
+        with self._lock:
+            db = self._connect()
+            db.executescript(SCHEMA)
+            # stores created before items had a sha
+            if "sha" not in [column[1] for column in db.execute("PRAGMA table_info(items)")]:
+                db.execute("ALTER TABLE items ADD COLUMN sha TEXT")
+
+    def _connect(self) -> sqlite3.Connection:
+        # only ever used with _lock held; a connection can't be carried over a fork
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+            self._pending = {}
+        return self._db
+
+    def get(self, item_id: str, lang: str=None, sha: str=None) -> dict:
+        """
+        Return the item data stored for item_id in lang, or None. With sha, an item
+        stored for any other sha, or for an unknown one, counts as not stored, except
+        for items downloaded before the store existed.
+        """
+        key = (item_id, lang or "")
+        with self._lock:
+            row = self._pending.get(key)
+            if row is None:
+                row = self._connect().execute("SELECT data, sha FROM items WHERE id = ? AND lang = ?", key).fetchone()
+                if row is None:
+                    row = self._read_legacy(item_id, lang, sha)
+        if row is None or (sha is not None and row[1] != sha):
+            return None
+        return json.loads(row[0])
+
+    def add(self, item_id: str, lang: str, item_data: dict, sha: str=None):
+        """
+        Store item_data for item_id in lang, downloaded for the KA sha sha, replacing
+        what was stored before.
+        """
+        with self._lock:
+            self._connect()
+            self._pending[(item_id, lang or "")] = (json.dumps(item_data), sha)
+            if len(self._pending) >= INSERT_BATCH_SIZE:
+                self._flush()
+
+    def flush(self):
+        """
+        Write the items added since the last flush to the database.
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        db = self._connect()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO items (id, lang, data, sha) VALUES (?, ?, ?, ?)",
+                           ((item_id, lang, data, sha) for (item_id, lang), (data, sha) in self._pending.items()))
+        self._pending = {}
+
+    def _read_legacy(self, item_id, lang, sha):
+        # items downloaded before the store existed are copied into it as they're read,
+        # taken to be of the sha they're first asked for with, since it wasn't recorded
+        filename = "{}_{}.json".format(item_id, lang) if lang else "{}.json".format(item_id)
+        path = os.path.join(self.cachedir, LEGACY_DIRNAME, filename)
+        try:
+            with open(path, "r") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            json.loads(data)
+        except ValueError:
+            logging.warning("Ignoring corrupt cached assessment item {}".format(path))
+            return None
+        self._pending[(item_id, lang or "")] = row = (data, sha)
+        return row
+
+    def __len__(self):
+        with self._lock:
+            self._flush()
+            return self._connect().execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_item_store(cachedir: str=None) -> AssessmentItemStore:
+    """
+    Return the AssessmentItemStore of cachedir (build/ by default), shared by everything
+    in the process.
+    """
+    cachedir = cachedir or os.path.join(os.getcwd(), "build")
+    with _STORES_LOCK:
+        if cachedir not in _STORES:
+            _STORES[cachedir] = AssessmentItemStore(cachedir)
+        return _STORES[cachedir]
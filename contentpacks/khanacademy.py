@@ -1,21 +1,14 @@
 import collections
 import copy
 import filecmp
-import fnmatch
-import glob
 import logging
 import os
 import re
-import shutil
 import urllib
-import tempfile
-import zipfile
 from collections import OrderedDict
 from functools import reduce
-from multiprocessing.pool import ThreadPool
+import functools
 import itertools
-import time
-import polib
 import requests
 import json
 import ujson
@@ -27,7 +20,13 @@ from math import ceil, log, exp
 
 from contentpacks.utils import NodeType, download_and_cache_file, Catalog, cache_file,\
     is_video_node_dubbed, get_lang_name, NodeType, get_lang_native_name,\
-    get_lang_ka_name, get_lang_code_list, translate_assessment_item_text
+    get_lang_ka_name, get_lang_code_list, get_langlookup, translate_assessment_item_text, NOT_MODIFIED,\
+    iter_json_arrays, ResourceDownloader, remove_assessment_data_with_empty_widgets
+from contentpacks import client
+from contentpacks.catalogs import CompiledCatalog, load_catalog
+from contentpacks.client import fetch_all
+from contentpacks.itemstore import get_item_store
+from contentpacks.models import NodeRecord
 # from contentpacks.models import AssessmentItem
 from contentpacks.generate_dubbed_video_mappings import main, DUBBED_VIDEOS_MAPPING_FILEPATH
 
@@ -89,7 +88,21 @@ PROJECTION_KEYS = OrderedDict([
 ])
 
 API_URL = "http://{ka_domain}/api/v2/topics/topictree?lang={lang}&projection={projection}"
-KA_DOMAIN = "www.khanacademy.org"
+# The host the KA API is reached at. Can be pointed at a stand-in server, see contentpacks.replay.
+KA_DOMAIN = os.environ.get("KA_DOMAIN") or "www.khanacademy.org"
+
+# How many bytes of the topic tree are read from the response at a time.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Data that doesn't change between language packs built in the same process,
+# keyed by the language code it was retrieved for.
+_KA_CATALOGS = {}
+_EXERCISE_DICTS = {}
+_VIDEO_ID_ENGLISH_MAPPING = None
+
+# Data shared by all languages, see load_shared_resources
+_DUBBED_VIDEO_MAPPINGS = None
+_ENGLISH_NODES = None
 
 LangpackResources = collections.namedtuple(
     "LangpackResources",
@@ -99,24 +112,6 @@ LangpackResources = collections.namedtuple(
      ])
 
 
-# monkey patch polib.POEntry.merge
-def new_merge(self, other):
-    """
-    Add the non-plural msgstr of `other` rather than an empty string.
-
-    Basically, re-add the change in
-    https://github.com/learningequality/ka-lite/commit/9f0aa49579a5d4c98df548863d20a252ed93220e
-    but using monkey patching rather than editing the source file directly.
-    """
-    self.old_merge(other)
-    self.msgstr = other.msgstr if other.msgstr else self.msgstr
-
-
-POEntry_class = polib.POEntry
-POEntry_class.old_merge = POEntry_class.merge
-POEntry_class.merge = new_merge
-
-
 def retrieve_language_resources(version: str, sublangargs: dict, ka_domain: str, no_subtitles: bool, no_dubbed_videos: bool) -> LangpackResources:
     node_data = retrieve_kalite_data(lang=sublangargs["content_lang"], force=True, ka_domain=ka_domain, no_dubbed_videos=no_dubbed_videos)
 
@@ -126,6 +121,8 @@ def retrieve_language_resources(version: str, sublangargs: dict, ka_domain: str,
     interface_lang = sublangargs["interface_lang"]
     if interface_lang == EN_LANG_CODE:
         ka_catalog = Catalog()
+    elif interface_lang in _KA_CATALOGS:
+        ka_catalog = _KA_CATALOGS[interface_lang]
     else:
         # retrieve Khan Academy po files from CrowdIn
         crowdin_project_name = "khanacademy"
@@ -133,12 +130,13 @@ def retrieve_language_resources(version: str, sublangargs: dict, ka_domain: str,
         includes = []
         ka_catalog = retrieve_translations(crowdin_project_name, crowdin_secret_key,
                                            lang_code=sublangargs["interface_lang"], force=True)
+        _KA_CATALOGS[interface_lang] = ka_catalog
 
     return LangpackResources(node_data, subtitle_data, ka_catalog)
 
 
 def retrieve_translations(crowdin_project_name, crowdin_secret_key, lang_code=EN_LANG_CODE, force=False,
-                          includes="*.po") -> Catalog:
+                          includes="*.po") -> CompiledCatalog:
     request_url_template = ("https://api.crowdin.com/api/"
                             "project/{project_id}/download/"
                             "{lang_code}.zip?key={key}")
@@ -151,37 +149,8 @@ def retrieve_translations(crowdin_project_name, crowdin_secret_key, lang_code=EN
 
     logging.debug("Retrieving translations from {}".format(request_url))
     zip_path = download_and_cache_file(request_url, ignorecache=force)
-    zip_extraction_path = tempfile.mkdtemp()
-
-    with zipfile.ZipFile(zip_path) as zf:
-        zf.extractall(zip_extraction_path)
-
-    all_filenames = glob.iglob(
-        os.path.join(zip_extraction_path, "**"),
-        recursive=True
-    )
-    filenames = fnmatch.filter(all_filenames, includes)
-
-    # use the polib library, since it's much faster at concatenating
-    # po files.  it doesn't have a dict interface though, so we'll
-    # reread the file using babel.Catalog.
-    with tempfile.NamedTemporaryFile() as f:
-        main_pofile = polib.POFile(fpath=f.name)
-
-        for filename in filenames:
-            pofile = polib.pofile(filename)
-            main_pofile.merge(pofile)
-
-        for entry in main_pofile:
-            entry.obsolete = False
-
-        main_pofile.save()
 
-    shutil.rmtree(zip_extraction_path)
-
-    msgid_mapping = Catalog(main_pofile)
-
-    return msgid_mapping
+    return load_catalog(zip_path, includes)
 
 
 def _get_video_ids(node_data: list) -> [str]:
@@ -196,17 +165,19 @@ first_cap_re = re.compile('(.)([A-Z][a-z]+)')
 all_cap_re = re.compile('([a-z0-9])([A-Z])')
 
 
+@functools.lru_cache(maxsize=None)
 def convert_camel_case(name) -> str:
     s1 = first_cap_re.sub(r'\1_\2', name)
     return all_cap_re.sub(r'\1_\2', s1).lower()
 
 
+def convert_node_to_camel_case(node) -> NodeRecord:
+    return NodeRecord((convert_camel_case(k), v) for k, v in node.items())
+
+
 def convert_all_nodes_to_camel_case(nodes) -> list:
     for i, node in enumerate(nodes):
-        new_node = {}
-        for k, v in node.items():
-            new_node[convert_camel_case(k)] = v
-        nodes[i] = new_node
+        nodes[i] = convert_node_to_camel_case(node)
     return nodes
 
 
@@ -265,11 +236,15 @@ def modify_ids(nodes, lang=EN_LANG_CODE) -> list:
 
 
 def get_video_id_english_mappings(lang):
+    global _VIDEO_ID_ENGLISH_MAPPING
     if lang == EN_LANG_CODE:
         mapping = {}
+    elif _VIDEO_ID_ENGLISH_MAPPING is not None:
+        # the mapping comes from the English topic tree, so it's the same for every language
+        mapping = _VIDEO_ID_ENGLISH_MAPPING
     else:
-        logging.info("Creating mapping for nodes"
-                     " between en and {}".format(lang))
+        logging.info("Creating mapping for video nodes"
+                     " between en and other languages")
 
         projection = {"videos": [
             OrderedDict(
@@ -277,22 +252,17 @@ def get_video_id_english_mappings(lang):
                  ("id", 1)]
             )]}
 
-        url_template = "http://www.khanacademy.org/api/v2/topics/topictree?projection={projection}"
-        url = url_template.format(lang=lang, projection=json.dumps(projection))
+        url_template = "http://{ka_domain}/api/v2/topics/topictree?projection={projection}"
+        url = url_template.format(ka_domain=KA_DOMAIN, projection=json.dumps(projection))
 
-        while 1:
-            try:
-                r = requests.get(url)
-                r.raise_for_status()
-                break
-            except requests.exceptions.HTTPError as e:
-                logging.warning("Got an error from Khan Academy requesting from their topic tree url: {}".format(e))
-                logging.warning("Trying again.")
+        r = client.get(url)
+        r.raise_for_status()
 
         english_video_data = r.json()
         english_video_data = english_video_data["videos"]
 
         mapping = {n["id"]: n["youtubeId"] for n in english_video_data}
+        _VIDEO_ID_ENGLISH_MAPPING = mapping
 
     return mapping
 
@@ -383,14 +353,11 @@ def create_paths_remove_orphans_and_empty_topics(nodes) -> list:
 
 
 @cache_file
-def download_exercise_data(url, path) -> str:
-    data = requests.get(url)
-
-    attempts = 1
-    while data.status_code != 200 and attempts <= 5:
-        data = requests.get(url)
-        attempts += 1
+def download_exercise_data(url, path, validators=None) -> dict:
+    data = client.get(url, headers=client.conditional_headers(validators or {}))
 
+    if data.status_code == 304:
+        return NOT_MODIFIED
     if data.status_code != 200:
         raise requests.RequestException
 
@@ -399,78 +366,132 @@ def download_exercise_data(url, path) -> str:
     with open(path, "w") as f:
         ujson.dump(exercise_data, f)
 
+    return client.response_validators(data)
+
 
 def retrieve_exercise_dict(lang=None, force=False) -> str:
+    if lang in _EXERCISE_DICTS and not force:
+        return _EXERCISE_DICTS[lang]
+
     lang_codes = get_lang_code_list(lang)
     exercise_data = []
-    for lang in lang_codes:
-        url = "https://www.khanacademy.org/api/internal/exercises" + ("?lang={lang}".format(lang=lang) if lang else "")
-        exercise_data_path = download_exercise_data(url, ignorecache=force, filename="exercises.json")
+    for lang_code in lang_codes:
+        url = "https://{ka_domain}/api/internal/exercises".format(ka_domain=KA_DOMAIN) + ("?lang={lang}".format(lang=lang_code) if lang_code else "")
+        exercise_data_path = download_exercise_data(url, ignorecache=force, filename="exercises_{lang}.json".format(lang=lang_code))
         with open(exercise_data_path, 'r') as f:
             exercise_data += ujson.load(f)
 
-    return {ex.get("id"): ex for ex in exercise_data}
+    _EXERCISE_DICTS[lang] = {ex.get("id"): ex for ex in exercise_data}
+    return _EXERCISE_DICTS[lang]
+
+
+EXERCISE_METADATA_URL = "http://{ka_domain}/api/v1/exercises".format(ka_domain=KA_DOMAIN)
+
+# Fields of the exercises API response that get merged into exercise nodes
+EXERCISE_METADATA_FIELDS = ["image_url_256", "suggested_completion_criteria"]
+
+_EXERCISE_METADATA = None
 
 
 @cache_file
-def download_and_clean_kalite_data(url, path, lang=EN_LANG_CODE) -> str:
-    logging.info("Downloading... " + url)
-    attempts = 1
-    while attempts < 100:
-        data = requests.get(url)
-        try:
-            data.raise_for_status()
-            break
-        except requests.RequestException as e:
-            logging.warning("Attempt {attempt}: Got error while requesting KA data: {e!s:<80}".format(
-                attempt=attempts,
-                e=e)
-            )
-            attempts += 1
-            time.sleep(10)
-            continue
+def download_exercise_metadata(url, path, validators=None) -> dict:
+    data = client.get(url, headers=client.conditional_headers(validators or {}))
 
-    data.raise_for_status()     # make sure that when we get here, there are no more errors from KA.
+    if data.status_code == 304:
+        return NOT_MODIFIED
+    data.raise_for_status()
 
-    node_data = ujson.loads(data.content)
+    metadata = {}
+    for ex in ujson.loads(data.content):
+        metadata[ex["node_slug"].split("/")[-1]] = {field: ex.get(field) for field in EXERCISE_METADATA_FIELDS}
 
-    # Convert all keys of nodes to snake case from camel case.
-    for key in node_data:
-        node_data[key] = convert_all_nodes_to_camel_case(node_data[key])
+    with open(path, "w") as f:
+        ujson.dump(metadata, f)
 
-    # Remove any topic nodes that are hidden, deleted, or set to 'do_not_publish'
-    # Also remove those flags from the nodes themselves.
+    return client.response_validators(data)
 
-    topic_nodes = []
 
-    for node in node_data["topics"]:
-        hidden = node.pop("hide")
-        deleted = node.pop("deleted")
-        # We want to remove all of these, except the root node,
-        # the only node we do hide, but we use for defining the overall KA channel
-        if not (hidden or deleted) or node.get("id") == "x00000000":
-            topic_nodes.append(node)
+def retrieve_exercise_metadata(cachedir=None) -> dict:
+    """
+    Return the thumbnail and mastery model of every KA exercise, keyed by exercise slug.
 
-    node_data["topics"] = topic_nodes
+    The metadata is kept in the build cache, so later runs only send a conditional
+    request and reuse the cached copy when KA answers with a 304, or when KA can't be
+    reached. Within a process the metadata is only retrieved once.
+    """
+    global _EXERCISE_METADATA
+    if _EXERCISE_METADATA is not None:
+        return _EXERCISE_METADATA
 
-    # Hack to hardcode the mp4 format flag on Videos.
-    for node in node_data["videos"]:
-        node["format"] = "mp4"
+    filename = "exercise_metadata_by_slug.json"
+    try:
+        path = download_exercise_metadata(EXERCISE_METADATA_URL, cachedir=cachedir, ignorecache=True, filename=filename)
+    except requests.RequestException as e:
+        logging.warning("Could not revalidate exercise metadata, using the cached copy: {}".format(e))
+        path = download_exercise_metadata(EXERCISE_METADATA_URL, cachedir=cachedir, filename=filename)
+
+    with open(path, "r") as f:
+        _EXERCISE_METADATA = ujson.load(f)
+    return _EXERCISE_METADATA
+
+
+def add_exercise_metadata(node_data, metadata: dict):
+    """
+    Merge the thumbnail and mastery model of each exercise in metadata into the
+    matching exercise nodes of node_data, in place.
+    """
+    for node in node_data:
+        if node.get("kind") == NodeType.exercise:
+            fields = metadata.get(node.get("id"))
+            if fields:
+                node.update(fields)
+
+
+@cache_file
+def download_and_clean_kalite_data(url, path, lang=EN_LANG_CODE, validators=None) -> dict:
+    logging.info("Downloading... " + url)
+    data = client.get(url, stream=True, headers=client.conditional_headers(validators or {}))
+    if data.status_code == 304:
+        data.close()
+        return NOT_MODIFIED
+    data.raise_for_status()     # make sure that when we get here, there are no more errors from KA.
 
     # Hack to add basepoints to all Exercise data.
     ex_dict = retrieve_exercise_dict()
 
-    for node in node_data["exercises"]:
-        seconds_per_fast_problem = ex_dict.get(node.get("id"), {}).get("seconds_per_fast_problem", 0)
-        node["basepoints"] = ceil(7 * log(max(exp(5. / 7), seconds_per_fast_problem)))
+    # The topics, exercises and videos are parsed and cleaned one node at a time as
+    # they're read from the response, rather than loading the whole topic tree at once.
+    node_data = []
+    try:
+        for key, node in iter_json_arrays(data.iter_content(STREAM_CHUNK_SIZE)):
+            # Convert all keys of nodes to snake case from camel case.
+            node = convert_node_to_camel_case(node)
+
+            if key == "topics":
+                # Remove any topic nodes that are hidden, deleted, or set to 'do_not_publish'
+                # Also remove those flags from the nodes themselves.
+                hidden = node.pop("hide")
+                deleted = node.pop("deleted")
+                # We want to remove all of these, except the root node,
+                # the only node we do hide, but we use for defining the overall KA channel
+                if (hidden or deleted) and node.get("id") != "x00000000":
+                    continue
+
+            elif key == "videos":
+                # Hack to hardcode the mp4 format flag on Videos.
+                node["format"] = "mp4"
 
-        # if not english, prepend language code to file_name attribute of the exercise node
-        if lang != EN_LANG_CODE and not node["uses_assessment_items"]:
-            node["file_name"] = os.path.join(lang, node["file_name"])
+            elif key == "exercises":
+                seconds_per_fast_problem = ex_dict.get(node.get("id"), {}).get("seconds_per_fast_problem", 0)
+                node["basepoints"] = ceil(7 * log(max(exp(5. / 7), seconds_per_fast_problem)))
 
-    # Flatten node_data
+                # if not english, prepend language code to file_name attribute of the exercise node
+                if lang != EN_LANG_CODE and not node["uses_assessment_items"]:
+                    node["file_name"] = os.path.join(lang, node["file_name"])
 
-    node_data = [node for node_list in node_data.values() for node in node_list]
+            node_data.append(node)
+    finally:
+        data.close()
 
     # Modify slugs by kind to give more readable URLs
 
@@ -495,7 +516,9 @@ def download_and_clean_kalite_data(url, path, lang=EN_LANG_CODE) -> str:
     # Save node_data to disk
 
     with open(path, "w") as f:
-        ujson.dump(node_data, f)
+        ujson.dump([node.to_dict() for node in node_data], f)
+
+    return client.response_validators(data)
 
 
 def retrieve_kalite_data(lang=EN_LANG_CODE, force=False, ka_domain=KA_DOMAIN, no_dubbed_videos=False) -> list:
@@ -532,31 +555,70 @@ def retrieve_kalite_data(lang=EN_LANG_CODE, force=False, ka_domain=KA_DOMAIN, no
         logging.info("  Processing language code %s..." % lang_code)
         projection = json.dumps(PROJECTION_KEYS)
         url = API_URL.format(projection=projection, lang=lang_code, ka_domain=ka_domain)
-        node_data_path = download_and_clean_kalite_data(url, lang=lang_code, ignorecache=force, filename="nodes.json")
+        node_data_path = download_and_clean_kalite_data(url, lang=lang_code, ignorecache=force, filename="nodes_{lang}.json".format(lang=lang_code))
         with open(node_data_path, 'r') as f:
             node_data_temp = ujson.load(f)
         for node_temp in node_data_temp:
-            node_data.append(node_temp)
+            node_data.append(NodeRecord(node_temp))
     if not lang == EN_LANG_CODE and not no_dubbed_videos:
         node_data = add_dubbed_video_mappings(node_data, lang)
     return node_data
 
 
+def load_shared_resources():
+    """
+    Retrieve and parse the data every language pack needs regardless of its language:
+    the language lookup table, the exercise dict, the dubbed video mappings, the
+    English node data and video ids the dubbed videos are mapped from, and the content
+    that assessment item content links are resolved against.
+    """
+    get_langlookup()
+    retrieve_exercise_dict()
+    get_video_id_english_mappings(lang=None)
+    get_dubbed_video_mappings()
+    get_english_nodes()
+    get_content_by_readable_id()
+
+
+def get_dubbed_video_mappings() -> dict:
+    """
+    Return the dubbed video mappings of every language, generating
+    build/dubbed_video_mappings.json from the KA spreadsheet first if needed.
+    """
+    global _DUBBED_VIDEO_MAPPINGS
+    if _DUBBED_VIDEO_MAPPINGS is None:
+        # Create a dubbed_video_mappings.json, at build folder.
+        if os.path.exists(DUBBED_VIDEOS_MAPPING_FILEPATH):
+            logging.info('Dubbed videos json already exist at %s' % (DUBBED_VIDEOS_MAPPING_FILEPATH))
+        else:
+            main()
+
+        with open(DUBBED_VIDEOS_MAPPING_FILEPATH, 'r') as f:
+            _DUBBED_VIDEO_MAPPINGS = ujson.load(f)
+
+    return _DUBBED_VIDEO_MAPPINGS
+
+
+def get_english_nodes() -> list:
+    """
+    Return the cleaned English node data that dubbed videos are mapped from. The nodes
+    are shared between calls, so callers must copy any node they want to modify.
+    """
+    global _ENGLISH_NODES
+    if _ENGLISH_NODES is None:
+        # Generate and cache `en_nodes.json` for dubbed video mappings.
+        url = API_URL.format(projection=json.dumps(PROJECTION_KEYS), lang=EN_LANG_CODE, ka_domain=KA_DOMAIN)
+        en_nodes_path = download_and_clean_kalite_data(url, lang=EN_LANG_CODE, ignorecache=False, filename="en_nodes.json")
+        with open(en_nodes_path, 'r') as f:
+            _ENGLISH_NODES = [NodeRecord(node) for node in ujson.load(f)]
+
+    return _ENGLISH_NODES
+
+
 def add_dubbed_video_mappings(node_data, lang=EN_LANG_CODE):
     # Get the dubbed videos from the spreadsheet and substitute them
     # for the video, and topic attributes of the returned data struct.
-
-    # Create a dubbed_video_mappings.json, at build folder.
-    build_path = os.path.join(os.getcwd(), "build")
-    if os.path.exists(os.path.join(build_path, "dubbed_video_mappings.json")):
-        logging.info('Dubbed videos json already exist at %s' % (DUBBED_VIDEOS_MAPPING_FILEPATH))
-    else:
-        main()
-
-    # Get the list of video ids from dubbed video mappings
-    dubbed_videos_path = os.path.join(build_path, "dubbed_video_mappings.json")
-    with open(dubbed_videos_path, 'r') as f:
-        dubbed_videos_load = ujson.load(f)
+    dubbed_videos_load = get_dubbed_video_mappings()
 
     """
     Dubbed video mappings may use the ka_name, lang_name or native_name as
@@ -578,42 +640,36 @@ def add_dubbed_video_mappings(node_data, lang=EN_LANG_CODE):
     if not dubbed_videos_list:
         return node_data
 
-    youtube_ids = []
-    topic_path_list = []
+    youtube_ids = set()
+    topic_path_list = set()
     for node in node_data:
         node_kind = node.get("kind")
         if node_kind == NodeType.video:
             if node["translated_youtube_lang"] == lang:
-                youtube_ids.append(node.get("youtube_id"))
+                youtube_ids.add(node.get("youtube_id"))
         if node_kind == NodeType.topic:
-            topic_path_list.append(node.get("path"))
-
-    # Generate and cache `en_nodes.json` for dubbed video mappings.
-    url = API_URL.format(projection=json.dumps(PROJECTION_KEYS), lang=EN_LANG_CODE, ka_domain=KA_DOMAIN)
-    download_and_clean_kalite_data(url, lang=EN_LANG_CODE, ignorecache=False, filename="en_nodes.json")
-    en_nodes_path = os.path.join(build_path, "en_nodes.json")
-    with open(en_nodes_path, 'r') as f:
-        en_node_load = ujson.load(f)
+            topic_path_list.add(node.get("path"))
 
     translated_node_list = []
     # The en_nodes.json must be the same data structure to node_data variable from khan api.
-    for node in en_node_load:
+    for node in get_english_nodes():
         node_kind = node.get("kind")
         # Append all topics that's not in topic path list.
 
         if (node_kind == NodeType.topic):
             if not node["path"] in topic_path_list:
-                translated_node_list.append(node)
-                topic_path_list.append(node["path"])
+                translated_node_list.append(copy.copy(node))
+                topic_path_list.add(node["path"])
 
         if (node_kind == NodeType.video):
             youtube_id = node["youtube_id"]
             if youtube_id not in youtube_ids:
                 if youtube_id in dubbed_videos_list:
+                    node = copy.copy(node)
                     node["youtube_id"] = dubbed_videos_list[youtube_id]
                     node["translated_youtube_lang"] = lang
                     translated_node_list.append(node)
-                    youtube_ids.append(youtube_id)
+                    youtube_ids.add(youtube_id)
 
     # remove all video nodes who have a dubbed video associated with them
     node_data = [node for node in node_data if node.get('youtube_id') not in dubbed_videos_list]
@@ -621,32 +677,19 @@ def add_dubbed_video_mappings(node_data, lang=EN_LANG_CODE):
     return node_data
 
 
-@cache_file
-def download_assessment_item_data(url, path, lang=None, force=False) -> str:
+def download_assessment_item_data(url) -> dict:
     """
-    Retrieve assessment item data and save to disk
+    Retrieve assessment item data from KA
     :param url: url of assessment item
-    :param lang: language to retrieve data in
-    :param force: refetch assessment item and images even if it exists on disk
-    :return: path to assessment item file
-    """
-    attempts = 1
-    logging.info("Downloading assessment item data from {url}, attempt {attempts}".format(url=url, attempts=attempts))
-    data = requests.get(url)
-    while data.status_code != 200 and attempts <= 5:
-        logging.info(
-            "Downloading assessment item data from {url}, attempt {attempts}".format(url=url, attempts=attempts))
-        data = requests.get(url)
-        attempts += 1
+    :return: the assessment item data
+    """
+    logging.info("Downloading assessment item data from {url}".format(url=url))
+    data = client.get(url)
 
     if data.status_code != 200:
         raise requests.RequestException
 
-    item_data = ujson.loads(data.content)
-
-    with open(path, 'w') as f:
-        json.dump(item_data, f)
-        f.flush()
+    return ujson.loads(data.content)
 
 
 def _get_path_from_filename(filename):
@@ -745,63 +788,62 @@ def _old_content_links_to_local_links(matchobj):
 CONTENT_BY_READABLE_ID = None
 
 
-def _get_content_by_readable_id(readable_id):
+def get_content_by_readable_id() -> dict:
+    """
+    Return the English content nodes that assessment item content links are resolved
+    against, keyed by readable id. The nodes are those of get_english_nodes, so must
+    not be modified.
+    """
     global CONTENT_BY_READABLE_ID
     if not CONTENT_BY_READABLE_ID:
         CONTENT_BY_READABLE_ID = dict(
-            [(c.get("readable_id"), c) for c in retrieve_kalite_data() if c.get("readable_id")])
+            [(c.get("readable_id"), c) for c in get_english_nodes() if c.get("readable_id")])
+    return CONTENT_BY_READABLE_ID
+
+
+def _get_content_by_readable_id(readable_id):
+    content_by_readable_id = get_content_by_readable_id()
     try:
-        return CONTENT_BY_READABLE_ID[readable_id]
+        return content_by_readable_id[readable_id]
     except KeyError:
-        return CONTENT_BY_READABLE_ID.get(re.sub("\-+", "-", readable_id).lower())
+        return content_by_readable_id.get(re.sub("\-+", "-", readable_id).lower())
 
 
-def retrieve_assessment_item_data(assessment_item, lang=None, force=False, no_item_data=False, no_item_resources=False, content_catalog=None) -> (dict, [str]):
+def fetch_assessment_item_data(assessment_item, lang=None, force=False, sha=None) -> dict:
     """
-    Retrieve assessment item data and images for a single assessment item.
+    Return the untranslated data of assessment item, from the item store or else from KA.
     :param assessment_item: id of assessment item
     :param lang: language to retrieve data in
-    :param force: refetch assessment item and images even if it exists on disk
-    :return: tuple of dict of assessment item data and list of paths to files
+    :param force: refetch assessment item even if it's in the item store
+    :param sha: the current KA sha of the assessment item; a copy in the item store stored for another sha is refetched
     """
-    if no_item_data:
-        return {}, []
-
     if lang:
-        url = "http://www.khanacademy.org/api/v1/assessment_items/{assessment_item}?lang={lang}".format(lang=lang, assessment_item=assessment_item)
-        filename = "assessment_items/{assessment_item}_{lang}.json".format(lang=lang, assessment_item=assessment_item)
+        url = "http://{ka_domain}/api/v1/assessment_items/{assessment_item}?lang={lang}".format(ka_domain=KA_DOMAIN, lang=lang, assessment_item=assessment_item)
     else:
-        url = "http://www.khanacademy.org/api/v1/assessment_items/{assessment_item}"
-        filename = "assessment_items/{assessment_item}.json"
-    try:
-        url = url.format(assessment_item=assessment_item)
-        filename = filename.format(assessment_item=assessment_item)
-        path = download_assessment_item_data(url, filename=filename, lang=lang, force=force)
-    except requests.RequestException:
-        logging.error("Download failure for assessment item: {assessment_item}".format(assessment_item=assessment_item))
-        raise
+        url = "http://{ka_domain}/api/v1/assessment_items/{assessment_item}".format(ka_domain=KA_DOMAIN, assessment_item=assessment_item)
 
-    with open(path, "r") as f:
-        item_data = json.load(f)
+    item_store = get_item_store()
+    item_data = None if force else item_store.get(assessment_item, lang, sha=sha)
+    if item_data is None:
+        try:
+            item_data = download_assessment_item_data(url)
+        except requests.RequestException:
+            logging.error("Download failure for assessment item: {assessment_item}".format(assessment_item=assessment_item))
+            raise
+        item_store.add(assessment_item, lang, item_data, sha=sha)
+
+    return item_data
 
-    # TEMP HACK: translate the item text here before URLs are localized, because otherwise, later, Crowdin strings no longer match
-    if lang != "en" and content_catalog is not None:
-        item_data = list(translate_assessment_item_text([item_data], content_catalog))
-        if item_data:
-            item_data = item_data[0]
-        else:
-            return {}, []
 
+def prepare_assessment_item_data(item_data, downloader, no_item_resources=False) -> (dict, [str]):
+    """
+    Localize the urls in translated assessment item data, and download the images it uses.
+    :param downloader: ResourceDownloader to queue the images on
+    :return: tuple of dict of assessment item data and list of urls of its files, or ({}, []) if it has no question
+    """
     image_urls = find_all_image_urls(item_data)
     graphie_urls = find_all_graphie_urls(item_data)
-    urls = list(itertools.chain(image_urls, graphie_urls))
-
-    def _download_image_urls(url):
-        filename = MANUAL_IMAGE_URL_TO_FILENAME_MAPPING.get(url, os.path.basename(url))
-        filepath = _get_subpath_from_filename(filename)
-        return download_and_cache_file(url, filename=filepath)
-
-    file_paths = [] if no_item_resources else list(map(_download_image_urls, urls))
+    urls = [] if no_item_resources else list(itertools.chain(image_urls, graphie_urls))
 
     item_data = localize_image_urls(item_data)
     item_data = localize_content_links(item_data)
@@ -811,63 +853,118 @@ def retrieve_assessment_item_data(assessment_item, lang=None, force=False, no_it
     for k, v in ujson.loads(item_data["item_data"]).items():
         if k == "question":
             if not v.get("content"):
-                logging.info("Found empty assessment content from KA's API {assessment_item}".format(assessment_item=assessment_item))
+                logging.info("Found empty assessment content from KA's API {assessment_item}".format(assessment_item=item_data.get("id")))
                 return {}, []
 
-    return item_data, file_paths
+    for url in urls:
+        downloader.download(url, _get_resource_filename(url))
+
+    return item_data, urls
+
 
+def _get_resource_filename(url):
+    return _get_subpath_from_filename(MANUAL_IMAGE_URL_TO_FILENAME_MAPPING.get(url, os.path.basename(url)))
 
-def retrieve_all_assessment_item_data(lang=None, force=False, node_data=None, no_item_data=False, no_item_resources=False, content_catalog=None) -> ([dict], set):
+
+def retrieve_assessment_resources(urls) -> set:
     """
-    Retrieve Khan Academy assessment items and associated images from KA.
-    :param lang: language to retrieve data in
-    :param force: refetch all assessment items
-    :param node_data: list of dicts containing node data to collect assessment items for
-    :return: a tuple of a list of assessment item data dicts, and a list of filepaths for the zip file
+    Make sure the assessment item files at urls are in the build cache, downloading
+    any that aren't. Returns the urls that could not be downloaded.
     """
-    if not node_data:
-        node_data = retrieve_kalite_data(lang=lang)
+    downloader = ResourceDownloader()
+    for url in urls:
+        downloader.download(url, _get_resource_filename(url))
+    return downloader.wait()
 
-    pool = ThreadPool()
 
-    def _download_item_data_and_files(assessment_item):
+def _unique_assessment_items(node_data, item_ids=None) -> list:
+    assessment_items = {}
+    for node in node_data:
+        for assessment_item in node.get("all_assessment_items", []):
+            if item_ids is None or assessment_item.get("id") in item_ids:
+                assessment_items[assessment_item.get("id")] = assessment_item
+    return list(assessment_items.values())
+
+
+def _fetch_all_assessment_item_data(assessment_items, lang=None, force=False, concurrency=None):
+    """
+    Yield the data of each of assessment_items as it's fetched, leaving out the items
+    that couldn't be.
+    """
+    def _download_item_data(assessment_item):
         item_id = assessment_item.get("id")
         try:
-            item_data, file_paths = retrieve_assessment_item_data(item_id, lang=lang, force=force, no_item_data=no_item_data, no_item_resources=no_item_resources, content_catalog=content_catalog)
-            return item_data, file_paths
+            return fetch_assessment_item_data(item_id, lang=lang, force=force, sha=assessment_item.get("sha"))
         except requests.RequestException as e:
             logging.warning("got requests exception: {}".format(e))
-            return {}, []
         except json.JSONDecodeError:
             logging.warning("got a JSONDecodeError for {}".format(item_id))
-            return {}, []
         except urllib.error.HTTPError as e:
             logging.warning("querying assessment item {} got an error: ".format(item_id, e))
-            return {}, []
 
-    # Unique list of assessment_items
-    assessment_items = {}
-    for node in node_data:
-        for assessment_item in node.get("all_assessment_items", []):
-            assessment_items[assessment_item.get("id")] = assessment_item
+    return (data for data in fetch_all(_download_item_data, assessment_items, concurrency=concurrency) if data)
 
-    assessment_items = assessment_items.values()
+
+def _prepare_all_assessment_item_data(items, downloader, item_file_urls: dict, no_item_resources=False):
+    for item_data in items:
+        item_data, file_urls = prepare_assessment_item_data(item_data, downloader, no_item_resources=no_item_resources)
+        if item_data:
+            item_file_urls[item_data["id"]] = file_urls
+            yield item_data
+
+
+def retrieve_all_assessment_item_data(assessment_store, lang=None, force=False, node_data=None, no_item_data=False, no_item_resources=False,
+                                      content_catalog=None, concurrency=None, item_ids=None, strict=False) -> dict:
+    """
+    Retrieve Khan Academy assessment items and associated images from KA, appending
+    each item to assessment_store as soon as it's ready.
+    :param assessment_store: the RecordWriter the items are appended to, keyed by their id
+    :param lang: language to retrieve data in
+    :param force: refetch all assessment items
+    :param node_data: list of dicts containing node data to collect assessment items for
+    :param concurrency: how many assessment items to retrieve at once, see client.fetch_all
+    :param item_ids: if given, only the assessment items of node_data with these ids are retrieved
+    :param strict: leave out the items with any content that isn't translated
+    :return: a dict mapping the ids of the items appended to the urls of their files
+    """
+    if no_item_data:
+        return {}
+
+    if not node_data:
+        node_data = retrieve_kalite_data(lang=lang)
 
     logging.info("Retrieving assessment item data for all assessment items.")
-    data_and_files = pool.map(_download_item_data_and_files, assessment_items)
-    try:
-        assessment_item_data, all_file_paths = zip(*data_and_files)
-    except ValueError:
-        logging.warning("No assessment iitems fetched at all.")
-        return [], set()
+    # each item is translated, localized and has its images queued as soon as it's
+    # been fetched, so images download while later items are still being fetched
+    items = _fetch_all_assessment_item_data(_unique_assessment_items(node_data, item_ids), lang=lang, force=force,
+                                            concurrency=concurrency)
 
-    # remove empty assessment_item_data
-    assessment_item_data = (data for data in assessment_item_data if data)
+    # translate the item text before URLs are localized, because otherwise, later, Crowdin strings no longer match
+    if lang != "en" and content_catalog is not None:
+        items = translate_assessment_item_text(items, content_catalog, strict)
+
+    # the images of all items go through one downloader, so every image is only
+    # downloaded once however many items use it
+    downloader = ResourceDownloader()
+    item_file_urls = {}
+    items = _prepare_all_assessment_item_data(items, downloader, item_file_urls, no_item_resources=no_item_resources)
+    for item_data in remove_assessment_data_with_empty_widgets(items):
+        assessment_store.append(item_data, key=item_data["id"])
+    get_item_store().flush()
+    failed_urls = downloader.wait()
+    if not item_file_urls:
+        logging.warning("No assessment iitems fetched at all.")
 
-    # all_file_paths is a list of lists, so we need to flatten it first before deduping through set()
-    all_file_paths = itertools.chain.from_iterable(all_file_paths)
+    # leave out the items missing some of their files
+    for item_id in list(item_file_urls):
+        if item_id not in assessment_store.keys:
+            del item_file_urls[item_id]
+        elif failed_urls.intersection(item_file_urls[item_id]):
+            logging.warning("Skipping assessment item {} as some of its files could not be downloaded".format(item_id))
+            assessment_store.discard(item_id)
+            del item_file_urls[item_id]
 
-    return assessment_item_data, set(all_file_paths)
+    return item_file_urls
 
 
 def apply_dubbed_video_map(content_data: list, subtitles: list, lang: str) -> (list, int):
@@ -0,0 +1,142 @@
+"""
+Compact in-memory representation of the KA topic tree nodes passed around contentpacks.
+"""
+import collections.abc
+import sys
+
+# Every field a node can have once it's been cleaned by download_and_clean_kalite_data
+# and gone through the rest of the pipeline.
+NODE_FIELDS = (
+    # common to all kinds
+    "id",
+    "kind",
+    "slug",
+    "title",
+    "description",
+    "path",
+    "sort_order",
+    # topics
+    "child_data",
+    "do_not_publish",
+    # exercises
+    "all_assessment_items",
+    "curated_related_videos",
+    "display_name",
+    "file_name",
+    "name",
+    "prerequisites",
+    "uses_assessment_items",
+    "basepoints",
+    "image_url_256",
+    "suggested_completion_criteria",
+    # videos
+    "description_html",
+    "download_size",
+    "duration",
+    "format",
+    "image_url",
+    "keywords",
+    "license_name",
+    "readable_id",
+    "relative_url",
+    "remote_size",
+    "sha",
+    "total_files",
+    "translated_youtube_lang",
+    "youtube_id",
+)
+
+_NODE_FIELD_SET = frozenset(NODE_FIELDS)
+
+# Fields with only a handful of distinct values, which are interned so every
+# node shares the same string objects.
+INTERNED_FIELDS = frozenset(["kind", "format", "license_name", "translated_youtube_lang"])
+
+
+class NodeRecord(collections.abc.MutableMapping):
+    """
+    A topic tree node, stored in slots rather than a dict. It behaves like the dict
+    it replaces: fields are read and written with node[key], node.get(key), etc.,
+    and unset fields are missing keys. Keys that aren't one of NODE_FIELDS are kept
+    in a small overflow dict.
+    """
+
+    __slots__ = NODE_FIELDS + ("_extra",)
+
+    def __init__(self, data=(), **kwargs):
+        self.update(data, **kwargs)
+
+    def __getitem__(self, key):
+        if key in _NODE_FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        try:
+            return self._extra[key]
+        except (AttributeError, KeyError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _NODE_FIELD_SET:
+            if key in INTERNED_FIELDS and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            try:
+                self._extra[key] = value
+            except AttributeError:
+                self._extra = {key: value}
+
+    def __delitem__(self, key):
+        if key in _NODE_FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        else:
+            try:
+                del self._extra[key]
+            except (AttributeError, KeyError):
+                raise KeyError(key)
+
+    def __iter__(self):
+        for field in NODE_FIELDS:
+            if hasattr(self, field):
+                yield field
+        yield from getattr(self, "_extra", ())
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        if key in _NODE_FIELD_SET:
+            return hasattr(self, key)
+        return key in getattr(self, "_extra", ())
+
+    def get(self, key, default=None):
+        if key in _NODE_FIELD_SET:
+            return getattr(self, key, default)
+        return getattr(self, "_extra", {}).get(key, default)
+
+    def to_dict(self) -> dict:
+        """
+        Return the node as a plain dict, e.g. to serialize it as JSON.
+        """
+        return {key: self[key] for key in self}
+
+    # copy, deepcopy and pickle all go through the node's dict form
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.update(state)
+
+    def __eq__(self, other):
+        if isinstance(other, collections.abc.Mapping):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return "NodeRecord({!r})".format(self.to_dict())
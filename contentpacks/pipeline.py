@@ -0,0 +1,222 @@
+"""
+In-process entry points for building language packs.
+
+The Makefile targets repackage the project with pex and start a new interpreter for
+every language. The functions here do the same work from inside an already running
+process (e.g. the sushi chef), reusing the HTTP session and everything that was
+already downloaded or parsed by previous calls. build_language_packs builds several
+languages at once on a process pool.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+
+from contentpacks import client
+from contentpacks.khanacademy import retrieve_language_resources, apply_dubbed_video_map, \
+    retrieve_all_assessment_item_data, retrieve_assessment_resources, load_shared_resources, get_content_by_readable_id, \
+    KA_DOMAIN
+from contentpacks.utils import translate_nodes, remove_untranslated_exercises, \
+    remove_nonexistent_assessment_items_from_exercises, clean_node_data_items
+from contentpacks.records import RecordReader, RecordWriter, replace_store, INDEX_SUFFIX
+from contentpacks.snapshots import make_snapshot, load_snapshot, save_snapshot, remove_snapshot, fingerprint, \
+    diff_nodes, unchanged_items
+from contentpacks.coverage import CoverageIndex
+
+KA_LITE_VERSION = "0.16"
+
+# The sublanguages each language is built with, by makecontentpacks and the functions
+# here alike. Anything not listed here defaults to the language itself.
+LANGUAGE_SUBLANG_ARGS = {
+    "en": {},
+    "es": {"subtitle_lang": "es", "interface_lang": "es-ES", "content_lang": "es-ES"},
+    "pt-BR": {"video_lang": "pt-BR", "content_lang": "pt-BR"},
+    "sw": {"video_lang": "sw", "subtitle_lang": "sw"},
+    "pt-PT": {"video_lang": "pt-PT", "content_lang": "pt-PT"},
+    "bn": {},
+    "de": {},
+    "fr": {},
+    "da": {},
+    "bg": {},
+    "ka": {},
+    "id": {},
+    "hi": {},
+    "xh": {},
+    "ta": {},
+}
+
+
+def make_language_pack(lang, version, sublangargs, filename, ka_domain, no_assessment_items, no_subtitles, no_assessment_resources, no_dubbed_videos,
+                       delta=False, strict=False):
+    node_data, subtitle_data, content_catalog = retrieve_language_resources(version, sublangargs, ka_domain, no_subtitles, no_dubbed_videos)
+
+    node_data = translate_nodes(node_data, content_catalog)
+    node_data = list(node_data)
+    node_data, dubbed_video_count = apply_dubbed_video_map(node_data, subtitle_data, sublangargs["video_lang"])
+
+    assessment_store_path = 'assessment_data_{0}'.format(lang)
+
+    # in a delta build, the items that haven't changed since the last build are
+    # copied over from its assessment store. Snapshotting a build needs the targets of
+    # the content links, so other builds don't, and drop the now outdated snapshot.
+    snapshot = None
+    reused_resources = {}
+    if delta:
+        content_links = get_content_by_readable_id() if not no_assessment_items else {}
+        snapshot = make_snapshot(node_data, fingerprint(content_catalog, content_links, {
+            "no_assessment_items": no_assessment_items,
+            "no_assessment_resources": no_assessment_resources,
+            "sublangargs": sublangargs,
+            "strict": strict,
+        }))
+        reused_resources = _reusable_items(lang, snapshot, assessment_store_path)
+    else:
+        remove_snapshot(lang)
+    reused_ids = reused_resources.keys()
+
+    # the items of exercises that are sure to be dropped for want of another of their
+    # items aren't fetched at all
+    skipped_ids = set()
+    if lang != "en" and not no_assessment_items:
+        coverage = CoverageIndex(node_data, content_catalog, lang, strict=strict)
+        coverage.log_summary(lang)
+        skipped_ids = coverage.skipped_items()
+
+    item_ids = None
+    if reused_ids or skipped_ids:
+        item_ids = {item["id"] for node in node_data for item in node.get("all_assessment_items", [])}
+        item_ids -= reused_ids | skipped_ids
+
+    # write the assessment items out as they come, keeping only their ids in memory
+    with RecordWriter(assessment_store_path + '.new') as assessment_store:
+        # now include only the assessment item resources that we need
+        item_file_urls = retrieve_all_assessment_item_data(
+            assessment_store,
+            no_item_data=no_assessment_items,
+            no_item_resources=no_assessment_resources,
+            node_data=node_data,
+            lang=lang,
+            content_catalog=content_catalog,
+            item_ids=item_ids,
+            strict=strict,
+        )
+        if reused_ids:
+            with RecordReader(assessment_store_path) as previous_store:
+                for item_id in reused_ids:
+                    assessment_store.append(previous_store[item_id], key=item_id)
+            item_file_urls.update(reused_resources)
+    replace_store(assessment_store_path + '.new', assessment_store_path)
+    assessment_ids = assessment_store.keys
+
+    node_data = remove_nonexistent_assessment_items_from_exercises(node_data, assessment_ids)
+
+    node_data = clean_node_data_items(node_data)
+    node_data = remove_untranslated_exercises(node_data, assessment_ids) if lang != "en" else node_data
+    node_data = list(node_data)
+    node_data = sorted(node_data, key=lambda x: x.get('sort_order'))
+
+    with RecordWriter('node_data_{0}'.format(lang)) as node_store:
+        for node in node_data:
+            node_store.append(node)
+
+    if snapshot is not None:
+        # the items that didn't make it into the store, because they were skipped, failed
+        # to download or were left out, mustn't count as unchanged in the next delta build
+        snapshot["items"] = {item_id: sha for item_id, sha in snapshot["items"].items() if item_id in assessment_ids}
+        snapshot["resources"] = {item_id: item_file_urls[item_id] for item_id in assessment_ids if item_id in item_file_urls}
+        save_snapshot(lang, snapshot)
+
+
+def _reusable_items(lang: str, snapshot: dict, assessment_store_path: str) -> dict:
+    """
+    Return the assessment items of the last delta build of lang that the build with
+    snapshot can copy over from its assessment store at assessment_store_path, as a
+    dict mapping their ids to the urls of their files.
+    """
+    previous_snapshot = load_snapshot(lang)
+    if not previous_snapshot or not os.path.exists(assessment_store_path + INDEX_SUFFIX):
+        return {}
+
+    for kind, counts in sorted(diff_nodes(previous_snapshot, snapshot).items()):
+        logging.info("{kind}: {added} added, {removed} removed, {changed} changed since the last build".format(
+            kind=kind, added=counts["added"], removed=counts["removed"], changed=counts["changed"]))
+
+    # only the items that made it into the last build can be reused, the others are retried
+    with RecordReader(assessment_store_path) as previous_store:
+        reused_ids = {item_id for item_id in unchanged_items(previous_snapshot, snapshot) if item_id in previous_store}
+
+    # the files of the reused items are looked up in the build cache, which marks them
+    # as used by this build so they aren't evicted, and restores any that have gone
+    # missing; items whose files can't be restored are built again
+    reused_resources = {item_id: previous_snapshot["resources"].get(item_id, []) for item_id in reused_ids}
+    failed_urls = retrieve_assessment_resources(set(itertools.chain.from_iterable(reused_resources.values())))
+    reused_resources = {item_id: urls for item_id, urls in reused_resources.items() if not failed_urls.intersection(urls)}
+    logging.info("Reusing {} of {} assessment items from the last build".format(len(reused_resources), len(snapshot["items"])))
+    return reused_resources
+
+
+def get_sublang_args(lang: str) -> dict:
+    """
+    Return the sublanguage arguments used to build lang, in the form retrieve_language_resources expects.
+    """
+    sublangargs = {
+        "video_lang": lang,
+        "content_lang": lang,
+        "interface_lang": lang,
+        "subtitle_lang": lang,
+    }
+    sublangargs.update(LANGUAGE_SUBLANG_ARGS.get(lang, {}))
+    return sublangargs
+
+
+def build_language_pack(lang: str, version: str=KA_LITE_VERSION, ka_domain: str=None, no_assessment_items=False,
+                        no_subtitles=False, no_assessment_resources=False, no_dubbed_videos=False, delta=False, strict=False):
+    """
+    Build the node and assessment item stores for lang in the current process, with the
+    same sublanguages as its Makefile target. The stores are written to the working
+    directory as node_data_{lang} and assessment_data_{lang}. With delta, only the
+    assessment items that changed since the last delta build of lang are retrieved. With
+    strict, assessment items with any untranslated content are left out, along with
+    their exercises.
+    """
+    ka_domain = ka_domain or os.environ.get("KA_DOMAIN") or KA_DOMAIN
+    make_language_pack(lang, version, get_sublang_args(lang), None, ka_domain,
+                       no_assessment_items, no_subtitles, no_assessment_resources, no_dubbed_videos, delta=delta,
+                       strict=strict)
+
+
+def _build_language_pack_worker(args):
+    lang, options = args
+    try:
+        build_language_pack(lang, **options)
+    except Exception:
+        logging.exception("Building the {} language pack failed".format(lang))
+        return lang, False
+    return lang, True
+
+
+def build_language_packs(langs: list, processes: int=None, **options) -> list:
+    """
+    Build the language packs for all of langs, taking the same options as build_language_pack.
+
+    The data every language needs is retrieved once in this process, then the languages
+    are built in parallel by a pool of forked worker processes, which inherit it.
+    Returns the languages that failed to build.
+    """
+    load_shared_resources()
+
+    failed = []
+    processes = min(processes or multiprocessing.cpu_count(), max(len(langs), 1))
+    # the workers make their requests at the same time, so each gets its share of the rate limits
+    pool = multiprocessing.get_context("fork").Pool(processes, client.share_rate_limits, (processes,))
+    try:
+        for lang, succeeded in pool.imap_unordered(_build_language_pack_worker, [(lang, options) for lang in langs]):
+            if succeeded:
+                logging.info("Finished building the {} language pack".format(lang))
+            else:
+                failed.append(lang)
+    finally:
+        pool.close()
+        pool.join()
+
+    return failed
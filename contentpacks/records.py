@@ -0,0 +1,121 @@
+"""
+Append-only record stores, used to hand the node and assessment item data produced by
+make_language_pack over to the sushi chef.
+
+A store called `name` is made of two files: `name.records`, holding one JSON encoded
+record per line, and `name.index`, holding one `key<TAB>offset<TAB>length` line per
+record. Records are written as they are produced, and read back one at a time by key,
+so neither side has to hold the whole data set in memory. The index is written when
+the store is closed, so records can still be left out of it until then.
+"""
+import collections
+import collections.abc
+import os
+
+import ujson
+
+RECORDS_SUFFIX = ".records"
+INDEX_SUFFIX = ".index"
+
+
+class RecordWriter:
+    """
+    Appends records to a new store at path, replacing any store already there.
+    Records appended without a key are keyed by their position in the store.
+    Records with a to_dict method, like NodeRecord, are stored as what it returns.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._index = collections.OrderedDict()
+        self._count = 0
+        self._offset = 0
+        self._records = open(path + RECORDS_SUFFIX, "wb")
+
+    def append(self, record: dict, key: str=None):
+        if key is None:
+            key = str(self._count)
+        if hasattr(record, "to_dict"):
+            record = record.to_dict()
+        data = ujson.dumps(record).encode("utf-8")
+        self._records.write(data + b"\n")
+        self._index[key] = (self._offset, len(data))
+        self._offset += len(data) + 1
+        self._count += 1
+
+    def discard(self, key: str):
+        """
+        Leave the record appended under key out of the store. It stays in the records
+        file, but isn't indexed.
+        """
+        self._index.pop(key, None)
+
+    @property
+    def keys(self):
+        """
+        A set-like view of the keys of the records in the store.
+        """
+        return self._index.keys()
+
+    def close(self):
+        self._records.close()
+        with open(self.path + INDEX_SUFFIX, "w") as f:
+            for key, (offset, length) in self._index.items():
+                f.write("{key}\t{offset}\t{length}\n".format(key=key, offset=offset, length=length))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordReader(collections.abc.Mapping):
+    """
+    Read-only, dict-like view over a store written by RecordWriter. Only the index is
+    loaded up front; each record is read from disk and decoded when it's looked up.
+    Iterates over keys in the order the records were appended.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._offsets = collections.OrderedDict()
+        with open(path + INDEX_SUFFIX, "r") as f:
+            for line in f:
+                key, offset, length = line.rstrip("\n").split("\t")
+                self._offsets[key] = (int(offset), int(length))
+        self._records = open(path + RECORDS_SUFFIX, "rb")
+
+    def __getitem__(self, key):
+        offset, length = self._offsets[key]
+        # pread doesn't move the file position, so lookups are safe across threads
+        return ujson.loads(os.pread(self._records.fileno(), length, offset).decode("utf-8"))
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def close(self):
+        self._records.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def replace_store(src: str, dst: str):
+    """
+    Move the store at src over the one at dst.
+    """
+    os.replace(src + RECORDS_SUFFIX, dst + RECORDS_SUFFIX)
+    os.replace(src + INDEX_SUFFIX, dst + INDEX_SUFFIX)
@@ -0,0 +1,284 @@
+"""
+Record the HTTP responses the pipeline gets from KA, CrowdIn and Google Sheets, and
+play them back later, for offline and repeatable runs of make_language_pack and the
+sushi chef, e.g. to profile or benchmark them.
+
+The mode is set with the CONTENTPACKS_HTTP_MODE environment variable:
+
+- record: requests are made as usual, and every response is also saved to the archive.
+  Conditional and Range headers are left out of the requests sent, so what's saved
+  is the whole resource, and a response other than a 200 never replaces a 200.
+- replay: requests are answered from the archive only, and nothing is sent over the
+  network; requests that weren't recorded get a 404
+
+The archive is a SQLite database at CONTENTPACKS_HTTP_ARCHIVE (build/http_archive.sqlite3
+by default), holding the last 200, or else the last response, recorded for every method
+and url. The `key` parameter of urls, which carries the CrowdIn API key, isn't part of
+what's recorded.
+
+Recorded responses can also be served over HTTP by a stand-in KA server, which answers
+every request by its path and query alone. Pointing KA_DOMAIN at it sends all requests
+there, except for those the pipeline makes over https, like the one for the list of
+exercises; use replay mode to answer every request. Run it with
+`python -m contentpacks.replay serve`.
+
+Usage:
+  replay serve [--port=port] [--archive=archive]
+
+--port=port        The port to serve on [default: 8000].
+--archive=archive  The archive to serve, defaults to CONTENTPACKS_HTTP_ARCHIVE.
+"""
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+RECORD = "record"
+REPLAY = "replay"
+
+HTTP_MODE = os.environ.get("CONTENTPACKS_HTTP_MODE")
+HTTP_ARCHIVE = os.environ.get("CONTENTPACKS_HTTP_ARCHIVE") or os.path.join(os.getcwd(), "build", "http_archive.sqlite3")
+
+# query parameters left out of recorded urls
+SECRET_PARAMS = frozenset(["key"])
+
+# headers that no longer apply to a recorded body, which is stored decoded and whole
+DROPPED_HEADERS = frozenset(["content-encoding", "content-length", "transfer-encoding", "connection"])
+
+# request headers that would get a 304 or a partial body instead of the whole resource
+UNRECORDED_REQUEST_HEADERS = ("If-None-Match", "If-Modified-Since", "If-Range", "Range")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    method TEXT NOT NULL,
+    url TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    reason TEXT,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    recorded REAL NOT NULL,
+    PRIMARY KEY (method, url)
+);
+CREATE INDEX IF NOT EXISTS responses_path ON responses (method, path);
+"""
+
+
+def normalize_url(url: str) -> str:
+    """
+    Return url as it's recorded in the archive.
+    """
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+def _path(url: str) -> str:
+    parts = urlsplit(url)
+    return parts.path + ("?" + parts.query if parts.query else "")
+
+
+class Archive:
+    """
+    The recorded responses in the SQLite database at path. Safe to use from several
+    threads and processes at once.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._db() as db:
+            db.executescript(SCHEMA)
+
+    def _db(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads, or carried over a fork
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=60)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def save(self, method: str, url: str, status: int, reason: str, headers: dict, body: bytes):
+        """
+        Record the response to url, replacing the one recorded before unless that was a
+        200 and this isn't, so a failed request doesn't lose a good response.
+        """
+        url = normalize_url(url)
+        headers = {k: v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS}
+        with self._db() as db:
+            db.execute("INSERT INTO responses (method, url, path, status, reason, headers, body, recorded) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                       "ON CONFLICT (method, url) DO UPDATE SET status = excluded.status, reason = excluded.reason, "
+                       "headers = excluded.headers, body = excluded.body, recorded = excluded.recorded "
+                       "WHERE responses.status != 200 OR excluded.status = 200",
+                       (method, url, _path(url), status, reason, json.dumps(headers), body, time.time()))
+
+    def load(self, method: str, url: str):
+        """
+        Return the status, reason, headers and body recorded for url, or None.
+        """
+        row = self._db().execute("SELECT status, reason, headers, body FROM responses WHERE method = ? AND url = ?",
+                                 (method, normalize_url(url))).fetchone()
+        return self._row(row)
+
+    def load_path(self, method: str, path: str):
+        """
+        Return the status, reason, headers and body recorded for a url with path (and
+        query), on any host, or None.
+        """
+        row = self._db().execute("SELECT status, reason, headers, body FROM responses WHERE method = ? AND path = ? "
+                                 "ORDER BY recorded DESC LIMIT 1",
+                                 (method, _path(normalize_url(path)))).fetchone()
+        return self._row(row)
+
+    def _row(self, row):
+        if row is None:
+            return None
+        status, reason, headers, body = row
+        return status, reason, json.loads(headers), bytes(body)
+
+
+def build_response(request: requests.PreparedRequest, status: int, reason: str, headers: dict, body: bytes) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.reason = reason
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.raw = io.BytesIO(body)
+    response._content = body
+    response.url = request.url
+    response.request = request
+    return response
+
+
+class RecordingAdapter(BaseAdapter):
+    """
+    Sends requests with adapter, and saves every response it gets to archive. Requests
+    are sent without their conditional and Range headers, so the whole resource is
+    recorded; callers get the 200 in place of the 304 or 206 they may have asked for.
+    """
+
+    def __init__(self, adapter: BaseAdapter, archive: Archive):
+        super().__init__()
+        self.adapter = adapter
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        if any(name in request.headers for name in UNRECORDED_REQUEST_HEADERS):
+            request = request.copy()
+            for name in UNRECORDED_REQUEST_HEADERS:
+                request.headers.pop(name, None)
+        response = self.adapter.send(request, **kwargs)
+        # reading the content here means streamed responses are read in full, but they
+        # can still be iterated over afterwards
+        self.archive.save(request.method, request.url, response.status_code, response.reason,
+                          dict(response.headers), response.content)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Answers requests from archive, without sending anything over the network.
+    """
+
+    def __init__(self, archive: Archive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        recorded = self.archive.load(request.method, request.url)
+        if recorded is None:
+            logging.warning("No recorded response for {} {}".format(request.method, normalize_url(request.url)))
+            return build_response(request, 404, "Not Recorded", {}, b"")
+        return build_response(request, *recorded)
+
+    def close(self):
+        pass
+
+
+_ARCHIVES = {}
+
+
+def install(session: requests.Session, mode: str=None, archive_path: str=None):
+    """
+    Mount the adapter for mode (CONTENTPACKS_HTTP_MODE by default) on session, if any.
+    """
+    mode = mode or HTTP_MODE
+    if not mode:
+        return
+    archive_path = archive_path or HTTP_ARCHIVE
+    if archive_path not in _ARCHIVES:
+        _ARCHIVES[archive_path] = Archive(archive_path)
+    archive = _ARCHIVES[archive_path]
+
+    for prefix in ("http://", "https://"):
+        if mode == RECORD:
+            session.mount(prefix, RecordingAdapter(session.get_adapter(prefix + "example.com"), archive))
+        elif mode == REPLAY:
+            session.mount(prefix, ReplayAdapter(archive))
+        else:
+            raise ValueError("Unknown CONTENTPACKS_HTTP_MODE {!r}, expected {!r} or {!r}".format(mode, RECORD, REPLAY))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(archive: Archive, port: int, host: str="127.0.0.1") -> HTTPServer:
+    """
+    Return a server answering requests with the responses recorded in archive.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            recorded = archive.load_path("GET", self.path)
+            if recorded is None:
+                status, reason, headers, body = 404, "Not Recorded", {}, b""
+            else:
+                status, reason, headers, body = recorded
+            self.send_response(status, reason)
+            for name, value in headers.items():
+                # send_response already sent these
+                if name.lower() not in ("server", "date"):
+                    self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug(format, *args)
+
+    return _ThreadingHTTPServer((host, port), Handler)
+
+
+def main():
+    from docopt import docopt
+    args = docopt(__doc__)
+
+    logging.basicConfig(level=logging.INFO)
+    archive = Archive(args["--archive"] or HTTP_ARCHIVE)
+    server = make_server(archive, int(args["--port"]))
+    logging.info("Serving the responses recorded in {} on port {}".format(archive.path, args["--port"]))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Snapshots of what went into a language pack, for delta builds.
+
+After every delta build, a snapshot of the language's nodes, of the assessment items
+that made it into its assessment store and of the urls of the files each of them uses
+is saved to build/snapshots/nodes_{lang}.json,
+along with a fingerprint of everything else the assessment items were built from (the
+content catalog, the targets of their content links and the build options). The next
+delta build diffs the new nodes against the snapshot, and reuses the assessment items
+whose KA sha hasn't changed from the previous build's assessment store instead of
+fetching, translating and localizing them again. If the fingerprint has changed, every
+item is rebuilt. Builds that aren't delta builds remove the snapshot, since it no
+longer matches the assessment store.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+
+from contentpacks.catalogs import CompiledCatalog
+
+SNAPSHOT_DIR = "snapshots"
+
+# bumped whenever what a snapshot holds changes, so older snapshots are ignored
+SNAPSHOT_VERSION = 3
+
+
+def snapshot_path(lang: str, cachedir: str=None) -> str:
+    cachedir = cachedir or os.path.join(os.getcwd(), "build")
+    return os.path.join(cachedir, SNAPSHOT_DIR, "nodes_{lang}.json".format(lang=lang))
+
+
+def fingerprint(catalog, content_by_readable_id: dict, options: dict) -> str:
+    """
+    Return a hash of the inputs, other than the items themselves, that go into the
+    assessment items of a build.
+    """
+    sha256 = hashlib.sha256()
+    if isinstance(catalog, CompiledCatalog):
+        # compiled catalogs are named after the hash of the CrowdIn zip they were built from
+        sha256.update("{}\0".format(os.path.basename(catalog.path)).encode("utf-8"))
+    else:
+        for msgid in sorted(catalog):
+            sha256.update("{}\0{}\0".format(msgid, catalog[msgid]).encode("utf-8"))
+    for readable_id in sorted(content_by_readable_id):
+        sha256.update("{}\0{}\0".format(readable_id, content_by_readable_id[readable_id].get("path")).encode("utf-8"))
+    sha256.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return sha256.hexdigest()
+
+
+def make_snapshot(node_data: list, build_fingerprint: str) -> dict:
+    """
+    Return the snapshot of a build of node_data, with every assessment item of
+    node_data. Before it's saved, the items that didn't make it into the assessment
+    store are to be removed from its "items", so the next delta build retries them,
+    and the urls of the files of the items that made it added to its "resources".
+    """
+    nodes = {}
+    items = {}
+    for node in node_data:
+        data = node.to_dict() if hasattr(node, "to_dict") else node
+        nodes["{}:{}".format(node.get("kind"), node.get("id"))] = hashlib.sha1(
+            json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+        for item in node.get("all_assessment_items", []):
+            items[item["id"]] = item.get("sha")
+    return {"version": SNAPSHOT_VERSION, "fingerprint": build_fingerprint, "nodes": nodes, "items": items,
+            "resources": {}}
+
+
+def load_snapshot(lang: str, cachedir: str=None) -> dict:
+    path = snapshot_path(lang, cachedir)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        snapshot = json.load(f)
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        logging.info("Ignoring the snapshot of an older version at {}".format(path))
+        return None
+    return snapshot
+
+
+def save_snapshot(lang: str, snapshot: dict, cachedir: str=None):
+    path = snapshot_path(lang, cachedir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(path + ".tmp", path)
+
+
+def remove_snapshot(lang: str, cachedir: str=None):
+    try:
+        os.remove(snapshot_path(lang, cachedir))
+    except FileNotFoundError:
+        pass
+
+
+def diff_nodes(old: dict, new: dict) -> dict:
+    """
+    Return the number of added, removed and changed nodes of each kind between the
+    snapshots old and new.
+    """
+    counts = collections.defaultdict(collections.Counter)
+    for key, node_hash in new["nodes"].items():
+        kind = key.split(":", 1)[0]
+        if key not in old["nodes"]:
+            counts[kind]["added"] += 1
+        elif old["nodes"][key] != node_hash:
+            counts[kind]["changed"] += 1
+    for key in old["nodes"].keys() - new["nodes"].keys():
+        counts[key.split(":", 1)[0]]["removed"] += 1
+    return counts
+
+
+def unchanged_items(old: dict, new: dict) -> set:
+    """
+    Return the ids of the assessment items that don't need to be built again, given
+    the snapshot old of the previous build and new of the current one.
+    """
+    if old["fingerprint"] != new["fingerprint"]:
+        logging.info("The catalog, content links or build options changed, rebuilding all assessment items")
+        return set()
+    return {item_id for item_id, sha in new["items"].items()
+            if item_id in old["items"] and sha is not None and old["items"][item_id] == sha}
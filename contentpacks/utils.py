@@ -1,10 +1,12 @@
+import codecs
 import copy
+import fnmatch
+import inspect
 import logging
+import multiprocessing
 import os
 import pkgutil
 import re
-import requests
-from functools import partial
 from urllib.parse import urlparse
 from peewee import Using, SqliteDatabase, fn
 import polib
@@ -13,6 +15,11 @@ import json
 import zipfile
 import tempfile
 import pathlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from contentpacks import client
+from contentpacks.cache import get_cache, request_key
 
 
 class UnexpectedKindError(Exception):
@@ -44,6 +51,18 @@ ASSESSMENT_VERSION_FILENAME = "assessmentitems.version"
 
 LANGUAGELOOKUP_DATA = pkgutil.get_data('contentpacks', "resources/languagelookup.json")
 
+_langlookup = None
+
+
+def get_langlookup() -> dict:
+    """
+    Return the parsed languagelookup.json, parsing it only on first use.
+    """
+    global _langlookup
+    if _langlookup is None:
+        _langlookup = ujson.loads(LANGUAGELOOKUP_DATA)
+    return _langlookup
+
 
 class Catalog(dict):
     """
@@ -64,12 +83,79 @@ class Catalog(dict):
             self.update({m.msgid: m.msgstr for m in pofile if m.translated()})
 
 
+CATALOG_PARSE_PROCESSES = int(os.environ.get("CONTENTPACKS_CATALOG_PARSE_PROCESSES", multiprocessing.cpu_count()))
+
+
+def read_po_translations(zip_path: str, member: str) -> dict:
+    """
+    Parse the po file member of the zip file at zip_path, and return its translated
+    strings, msgid to msgstr. Fuzzy entries and empty msgstrs are left out; obsolete
+    entries are kept.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        text = zf.read(member).decode("utf-8")
+    return {entry.msgid: entry.msgstr for entry in polib.pofile(text)
+            if entry.msgstr and not entry.fuzzy}
+
+
+def _read_po_translations(args):
+    return read_po_translations(*args)
+
+
+def build_catalog(zip_path: str, includes: str="*.po", processes: int=None) -> Catalog:
+    """
+    Build a Catalog from the po files in the zip file at zip_path whose names match
+    includes, parsing them in parallel worker processes.
+
+    The files are merged in the order of their names: a msgid translated in several
+    files gets the msgstr of the last one.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        members = sorted(fnmatch.filter(zf.namelist(), includes))
+
+    processes = min(processes or CATALOG_PARSE_PROCESSES, len(members))
+    args = [(zip_path, member) for member in members]
+    # the workers of build_language_packs are daemons, which can't have children
+    if processes > 1 and not multiprocessing.current_process().daemon:
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            translations = pool.imap(_read_po_translations, args)
+            catalog = _merge_translations(translations)
+    else:
+        catalog = _merge_translations(map(_read_po_translations, args))
+
+    logging.debug("Built a catalog of {} strings from {} po files".format(len(catalog) - 1, len(members)))
+    return catalog
+
+
+def _merge_translations(translations) -> Catalog:
+    catalog = Catalog()
+    for strings in translations:
+        catalog.update(strings)
+    return catalog
+
+
+# returned by a cache_file function taking validators when the server answered its
+# conditional request with a 304
+NOT_MODIFIED = object()
+
+
 def cache_file(func):
     """
     Execute the decorated function only if the file in question is not already cached.
     Returns the path to the file. Always download the file if ignorecache is True.
     All decorated functions must only accept 2 args, 'url' and 'path'.
+
+    Downloaded files are kept in the build cache of cachedir, see contentpacks.cache.
+
+    Functions that also accept a 'validators' arg are passed the ETag and Last-Modified
+    of the cached file, if any, so forced downloads can be made conditional with
+    client.conditional_headers. They must return NOT_MODIFIED when the server answers
+    with a 304, in which case the cached file is kept, and the validators of the new
+    file (client.response_validators) otherwise. If the cached file has gone missing
+    by then, the file is downloaded again unconditionally.
     """
+    takes_validators = "validators" in inspect.signature(func).parameters
+
     def func_wrapper(url, cachedir=None, ignorecache=False, filename=None, **kwargs):
         if not cachedir:
             cachedir = os.path.join(os.getcwd(), "build")
@@ -78,37 +164,239 @@ def cache_file(func):
             filename = os.path.basename(urlparse(url).path) + urlparse(url).query
 
         path = os.path.join(cachedir, filename)
+        build_cache = get_cache(cachedir)
+        key = request_key(func, url, filename, kwargs)
 
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not ignorecache and _lookup_cached_file(build_cache, key, path):
+            return path
 
-        if ignorecache or not os.path.exists(path):
-            func(url, path, **kwargs)
+        validators = None
+        if takes_validators:
+            validators = build_cache.validators(key) if ignorecache and build_cache.lookup(key, path) else {}
 
+        _download_to_cache(func, url, path, build_cache, key, validators, kwargs)
         return path
 
     return func_wrapper
 
 
+def _lookup_cached_file(build_cache, key: str, path: str) -> bool:
+    cached = build_cache.lookup(key, path)
+    if cached is None and os.path.exists(path):
+        # downloaded before the cache kept a manifest
+        build_cache.adopt(key, path)
+        return True
+    return bool(cached)
+
+
+def _download_to_cache(func, url: str, path: str, build_cache, key: str, validators: dict, kwargs: dict):
+    """
+    Download url with the cache_file function func, and store it in build_cache under
+    key at path. validators is None for functions that don't take validators.
+    """
+    # download to a file of its own, so a failed download never leaves a broken
+    # file at path
+    staging_path = build_cache.staging_path(path)
+    try:
+        if validators is None:
+            func(url, staging_path, **kwargs)
+        else:
+            validators = _conditional_download(func, url, staging_path, build_cache, key, path, validators, kwargs)
+            if validators is NOT_MODIFIED:
+                logging.info("{} hasn't changed since it was cached".format(url))
+                return
+        build_cache.store(key, staging_path, path, validators=validators)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+
+def _conditional_download(func, url: str, staging_path: str, build_cache, key: str, path: str, validators: dict, kwargs: dict):
+    """
+    Download url to staging_path with the cache_file function func, conditionally on
+    validators, if any. Returns NOT_MODIFIED only if the file cached at path is there
+    to be kept, and the validators of the new file otherwise.
+    """
+    if validators:
+        new_validators = func(url, staging_path, validators=validators, **kwargs)
+        # the cached file may have been evicted since its validators were looked up
+        if new_validators is not NOT_MODIFIED or build_cache.lookup(key, path):
+            return new_validators
+        logging.warning("{} hasn't changed, but its cached file is gone, downloading it again".format(url))
+
+    new_validators = func(url, staging_path, validators={}, **kwargs)
+    if new_validators is NOT_MODIFIED:
+        raise client.DownloadError("Got a 304 for an unconditional request for {}".format(url))
+    return new_validators
+
+
 @cache_file
-def download_and_cache_file(url: str, path: str, headers: dict={}) -> str:
+def download_and_cache_file(url: str, path: str, headers: dict={}, validators: dict=None, sha256: str=None) -> dict:
     """
     Download the given url if it's not saved in cachedir. Returns the
-    path to the file. Always download the file if ignorecache is True.
+    path to the file. Always download the file if ignorecache is True,
+    unless the server says it hasn't changed since it was cached.
+    Interrupted downloads are resumed, see client.download.
     """
 
     logging.info("Downloading file from {url}".format(url=url))
 
-    r = requests.get(url, stream=True, headers=headers)
-    r.raise_for_status()
+    new_validators = client.download(url, path, headers=headers, validators=validators, sha256=sha256)
+    return NOT_MODIFIED if new_validators is None else new_validators
+
+
+# How many files a ResourceDownloader downloads at once.
+RESOURCE_DOWNLOAD_CONCURRENCY = int(os.environ.get("CONTENTPACKS_RESOURCE_DOWNLOAD_CONCURRENCY", 16))
+
+
+class ResourceDownloader:
+    """
+    Downloads files with download_and_cache_file on a pool of its own threads, so
+    the code finding the files doesn't wait on them. Each url is only downloaded
+    once: later requests for a url get the same future as the first one, whether its
+    download is still running or done.
+    """
+
+    def __init__(self, max_workers: int=None):
+        self._executor = ThreadPoolExecutor(max_workers or RESOURCE_DOWNLOAD_CONCURRENCY)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def download(self, url: str, filename: str) -> Future:
+        """
+        Queue url to be downloaded to filename in the build cache. Returns a future
+        for the path of the downloaded file.
+        """
+        with self._lock:
+            future = self._futures.get(url)
+            if future is None:
+                future = self._executor.submit(download_and_cache_file, url, filename=filename)
+                self._futures[url] = future
+        return future
+
+    def wait(self) -> set:
+        """
+        Wait for all queued downloads to finish, and return the urls that failed.
+        """
+        self._executor.shutdown(wait=True)
+        failed = set()
+        for url, future in self._futures.items():
+            e = future.exception()
+            if e is not None:
+                logging.warning("Could not download {url}: {e}".format(url=url, e=e))
+                failed.add(url)
+        return failed
+
 
-    with open(path, "wb") as f:
-        for chunk in r.iter_content(1024):
-            f.write(chunk)
+class _JsonReader:
+    """
+    A JSON tokenizer over an iterable of bytes chunks, which only reads as many
+    chunks as it needs to get to the next token.
+    """
 
-    return path
+    def __init__(self, chunks):
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._chunks = iter(chunks)
+        self._buf = ""
+        self._pos = 0
+        self._exhausted = False
+
+    def _read_more(self) -> bool:
+        # drops what has been parsed so far from the buffer
+        for chunk in self._chunks:
+            if chunk:
+                self._buf = self._buf[self._pos:] + self._utf8.decode(chunk)
+                self._pos = 0
+                return True
+        if self._exhausted:
+            return False
+        self._buf = self._buf[self._pos:] + self._utf8.decode(b"", final=True)
+        self._pos = 0
+        self._exhausted = True
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\n\r":
+                self._pos += 1
+            if self._pos < len(self._buf) or not self._read_more():
+                return
+
+    def peek(self) -> str:
+        """
+        Return the next character after any whitespace, or "" at the end of the input.
+        """
+        self.skip_whitespace()
+        return self._buf[self._pos:self._pos + 1]
+
+    def expect(self, chars: str) -> str:
+        """
+        Consume the next character, which must be one of chars, and return it.
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expected one of {!r} at {!r}".format(chars, self._buf[self._pos:self._pos + 20]))
+        self._pos += 1
+        return char
+
+    def value(self):
+        """
+        Decode and consume the next JSON value.
+        """
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._read_more():
+                    raise
+                continue
+            if self._may_continue(value, end) and self._read_more():
+                continue
+            self._pos = end
+            return value
+
+    def _may_continue(self, value, end: int) -> bool:
+        # a number at the end of the buffer may continue in the next chunk
+        return (isinstance(value, (int, float)) and not self._exhausted
+                and (end == len(self._buf) or self._buf[end] in "0123456789.eE+-"))
+
+    def elements(self):
+        """
+        Consume a JSON array, yielding its elements one by one.
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
 
 
-def translate_nodes(nodes: list, catalog: Catalog) -> list:
+def iter_json_arrays(chunks):
+    """
+    Incrementally parse a JSON object whose values are all arrays, like the KA topictree
+    API's {"topics": [...], "exercises": [...], "videos": [...]}, from chunks, an
+    iterable of bytes. Yields a (key, element) tuple for every element of every array as
+    soon as it has been read, so only one element needs to be held in memory at a time.
+    """
+    reader = _JsonReader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        for element in reader.elements():
+            yield key, element
+        if reader.expect(",}") == "}":
+            return
+
+
+def translate_nodes(nodes, catalog: Catalog):
     """Translates all fields across all nodes:
 
     (see NODE_FIELDS_TO_TRANSLATE for list)
@@ -116,52 +404,86 @@ def translate_nodes(nodes: list, catalog: Catalog) -> list:
     Note that translation in these fields is nonessential -- meaning
     that even if they're not translated they're not a dealbreaker, and
     thus won't be eliminated from the topic tree.
+
+    Yields the nodes one by one. A node with a translated field is
+    yielded as a shallow copy with the field replaced, sharing its
+    other values with the original; any other node is yielded as is.
     """
-    nodes = copy.deepcopy(nodes)
     for node in nodes:
+        translated = None
 
         for field in NODE_FIELDS_TO_TRANSLATE:
             msgid = node.get(field)
             if msgid:
                 try:
-                    node[field] = catalog[msgid]
+                    msgstr = catalog[msgid]
                 except KeyError:
                     logging.info("could not translate {field} for {title}".format(field=field, title=node["title"]))
+                    continue
+                if msgstr != msgid:
+                    if translated is None:
+                        translated = copy.copy(node)
+                    translated[field] = msgstr
 
-    return nodes
+        yield translated if translated is not None else node
 
 
-def translate_assessment_item_text(items: list, catalog: Catalog):
+class ItemTranslator:
     """
-    Expects a dict with assessment ids as key and the item data as
-    value, along with a catalog file from retrieve_language_resources
-    as translation source. Returns a series of key value pairs with
-    the id as key and the translated item data as the value.
-
-    Assessment item translations are considered essential, and thus
-    if they're found missing will make that exercise as unavailable.
+    Translates the item data of assessment items through catalog. Each distinct
+    string is looked up in the catalog only once, however many items use it. With
+    strict, items with content the catalog doesn't translate aren't translatable.
     """
 
-    # TODO (aronasorman): implement tests
-    def gettext(s):
+    def __init__(self, catalog: Catalog, strict: bool=False):
+        self.catalog = catalog
+        self.strict = strict
+        self._translations = {}
+
+    def gettext(self, s):
         """
         Convenience function for translating text through the given catalog.
         """
-        trans = catalog.get(s) or s
-
+        try:
+            trans = self._translations[s]
+        except KeyError:
+            trans = self._translations[s] = self.catalog.get(s) or (None if self.strict else s)
+        if trans is None:
+            raise NotTranslatable(s)
         return trans
 
-    for item in items:
+    def translate(self, item: dict) -> dict:
+        """
+        Return a copy of item with its item data translated. Raises NotTranslatable
+        if it can't be.
+        """
         item = copy.copy(item)
+        item_data = smart_translate_item_data(ujson.loads(item["item_data"]), self.gettext)
+        item["item_data"] = json.dumps(item_data)
+        return item
 
-        item_data = json.loads(item["item_data"])
-        try:
-            translated_item_data = smart_translate_item_data(item_data, gettext)
-        except NotTranslatable:
-            continue
-        else:
-            item["item_data"] = json.dumps(translated_item_data, gettext)
-            yield item
+    def translate_all(self, items):
+        for item in items:
+            try:
+                yield self.translate(item)
+            except NotTranslatable:
+                continue
+            except ValueError:
+                logging.warning("Skipping assessment item {} as its item data isn't valid JSON".format(item.get("id")))
+
+
+def translate_assessment_item_text(items: list, catalog: Catalog, strict: bool=False):
+    """
+    Expects a dict with assessment ids as key and the item data as
+    value, along with a catalog file from retrieve_language_resources
+    as translation source. Returns a series of key value pairs with
+    the id as key and the translated item data as the value.
+
+    Assessment item translations are considered essential, and thus
+    if they're found missing will make that exercise as unavailable.
+    With strict, items with any untranslated content are left out.
+    """
+    return ItemTranslator(catalog, strict).translate_all(items)
 
 
 def smart_translate_item_data(item_data: dict, gettext):
@@ -172,28 +494,28 @@ def smart_translate_item_data(item_data: dict, gettext):
     fields to translate, this function loops over all fields of
     item_data and translates only the content field.
 
+    Translates item_data in place, and returns it.
+
     Requires a gettext function.
     """
-    translate_item_fn = partial(smart_translate_item_data, gettext=gettext)
+    if isinstance(item_data, (dict, list)):
+        _translate_content_fields(item_data, gettext)
 
-    if isinstance(item_data, list):
-        return list(map(translate_item_fn, item_data))
+    return item_data
 
-    elif isinstance(item_data, dict):
-        if 'content' in item_data:
-            item_data['content'] = gettext(item_data['content']) if item_data['content'] else ""
 
-        for field, field_data in item_data.items():
-            if isinstance(field_data, dict):
-                item_data[field] = smart_translate_item_data(field_data, gettext)
-            elif isinstance(field_data, list):
-                item_data[field] = list(map(translate_item_fn, field_data))
+def _translate_content_fields(data, gettext):
+    if isinstance(data, dict):
+        if 'content' in data:
+            data['content'] = gettext(data['content']) if data['content'] else ""
+        data = data.values()
 
-    return item_data
+    for field_data in data:
+        if isinstance(field_data, (dict, list)):
+            _translate_content_fields(field_data, gettext)
 
 
-def remove_untranslated_exercises(nodes, translated_assessment_data):
-    item_data_ids = set([item.get("id") for item in translated_assessment_data])
+def remove_untranslated_exercises(nodes, item_data_ids: set):
 
     def is_translated_exercise(ex):
 
@@ -217,7 +539,7 @@ def remove_untranslated_exercises(nodes, translated_assessment_data):
 
 def get_lang_name(lang):
     try:
-        langlookup = ujson.loads(LANGUAGELOOKUP_DATA)
+        langlookup = get_langlookup()
         return langlookup[lang]["name"]
     except KeyError:
         logging.warning("No name found for {}. Defaulting to an empty string.".format(lang))
@@ -226,7 +548,7 @@ def get_lang_name(lang):
 
 def get_lang_native_name(lang):
     try:
-        langlookup = ujson.loads(LANGUAGELOOKUP_DATA)
+        langlookup = get_langlookup()
         return langlookup[lang]["native_name"]
     except KeyError:
         logging.warning("No native name found for {}. Defaulting to an empty string.".format(lang))
@@ -235,7 +557,7 @@ def get_lang_native_name(lang):
 
 def get_lang_ka_name(lang):
     try:
-        langlookup = ujson.loads(LANGUAGELOOKUP_DATA)
+        langlookup = get_langlookup()
         return langlookup[lang]["ka_name"]
     except KeyError:
         logging.warning("No ka name found for {}. Defaulting to an empty string.".format(lang))
@@ -261,7 +583,7 @@ def get_lang_code_list(lang):
             Return is `["so", "som"]`.
     """
     try:
-        langlookup = ujson.loads(LANGUAGELOOKUP_DATA)
+        langlookup = get_langlookup()
         lang_name = langlookup[lang]["name"]
 
         # TODO: Replace with list comprehension?
@@ -323,9 +645,7 @@ def remove_assessment_data_with_empty_widgets(assessment_data):
             )
 
 
-def remove_nonexistent_assessment_items_from_exercises(node_data: list, assessment_data: iter):
-    assessment_ids = set(assessment["id"] for assessment in assessment_data)
-
+def remove_nonexistent_assessment_items_from_exercises(node_data: list, assessment_ids: set):
     for node in node_data:
         if node["kind"] != NodeType.exercise:
             yield node
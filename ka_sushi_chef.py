@@ -6,45 +6,168 @@ from ricecooker.chefs import SushiChef
 from ricecooker.classes.nodes import (ChannelNode, ExerciseNode, VideoNode, TopicNode)
 from ricecooker.classes.questions import PerseusQuestion
 from ricecooker.classes.files import VideoFile, YouTubeSubtitleFile
-import subprocess
+from contentpacks import client
+from contentpacks.khanacademy import add_exercise_metadata, retrieve_exercise_metadata
+from contentpacks.pipeline import build_language_pack
+from contentpacks.records import RecordReader
+import collections
+import logging
+import multiprocessing
 import re
 import os
-import pickle
-import requests
-import copy
 
 FILE_URL_REGEX = re.compile('[\\\]*/content[\\\]*/assessment[\\\]*/khan[\\\]*/(?P<build_path>\w+)[\\\]*/(?P<filename>\w+)\.?(?P<ext>\w+)?', flags=re.IGNORECASE)
 REPLACE_STRING = "/content/assessment/khan"
 cwd = os.getcwd()
 IMAGE_DL_LOCATION = 'file://' + cwd + '/build'
 
+# matched assessment file references -> local file urls, shared across items since
+# the same images and graphies are referenced from many of them
+_FILE_URL_REPLACEMENTS = {}
 
-# recursive function to traverse tree and return parent node
-def _getNode(paths, tree):
-    for path in paths:
-        if path == tree.path:
-            # this means its the last node so we should return parent
-            if len(paths[1:]) == 1:
-                return tree
-            for child in tree.children:
-                parent = _getNode(paths[1:], child)
-                if parent:
-                    return parent
-        else:  # we are not going down right path so drop out
-            return None
+
+def _local_file_url(match):
+    url = match.group(0)
+    try:
+        return _FILE_URL_REPLACEMENTS[url]
+    except KeyError:
+        local_url = url.replace('\\', '').replace(REPLACE_STRING, IMAGE_DL_LOCATION)
+        _FILE_URL_REPLACEMENTS[url] = local_url
+        return local_url
+
+
+def localize_file_urls(item_data):
+    """
+    Replace every reference to an assessment image in item_data with the local file path
+    to the image, in a single scan of the string.
+    """
+    return FILE_URL_REGEX.sub(_local_file_url, item_data)
+
+
+# number of processes localizing assessment item data while the tree is built
+LOCALIZE_PROCESSES = int(os.environ.get("CONTENTPACKS_LOCALIZE_PROCESSES") or multiprocessing.cpu_count())
+
+# number of exercises whose item data is localized ahead of the one being created
+LOCALIZE_LOOKAHEAD = 64
+
+_worker_assessment_dict = None
+
+
+def _init_localize_worker(assessment_dict):
+    # handed over by the fork rather than pickled; RecordReader reads with pread, so
+    # the workers can share its file
+    global _worker_assessment_dict
+    _worker_assessment_dict = assessment_dict
+
+
+def _localize_items(item_ids):
+    return [localize_file_urls(_worker_assessment_dict[item_id]['item_data']) for item_id in item_ids]
+
+
+class ItemLocalizer:
+    """
+    Localizes the item data of the exercises in node_data on a pool of worker processes,
+    in node order, at most lookahead exercises ahead of the ones create_node has asked
+    for, so only those items are held in memory. Each worker reads the items it
+    localizes from assessment_dict itself. Exercises that weren't queued are localized
+    in this process when they're asked for.
+    """
+
+    def __init__(self, node_data, assessment_dict, processes=LOCALIZE_PROCESSES, lookahead=LOCALIZE_LOOKAHEAD):
+        self.assessment_dict = assessment_dict
+        self.lookahead = lookahead
+        self._exercises = (node for node in node_data if node.get('kind') == 'Exercise')
+        self._pending = collections.OrderedDict()  # exercise path -> AsyncResult
+        self._pool = None
+        if processes > 1:
+            self._pool = multiprocessing.get_context("fork").Pool(processes, _init_localize_worker, (assessment_dict,))
+            self._queue()
+
+    def _queue(self):
+        while len(self._pending) < self.lookahead:
+            node = next(self._exercises, None)
+            if node is None:
+                return
+            item_ids = [item['id'] for item in node['all_assessment_items']]
+            self._pending[node['path']] = self._pool.apply_async(_localize_items, (item_ids,))
+
+    def item_data(self, node):
+        """
+        Return the localized item data of the assessment items of the exercise node, in order.
+        """
+        result = self._pending.pop(node['path'], None)
+        if result is None:
+            return [localize_file_urls(self.assessment_dict[item['id']]['item_data']) for item in node['all_assessment_items']]
+        self._queue()
+        return result.get()
+
+    def close(self):
+        if self._pool is not None:
+            # whatever is still queued is for exercises that were never created
+            self._pool.terminate()
+            self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# attach nodes to the tree by looking up their parent in an index keyed by path,
+# holding back nodes whose parent has not been attached yet
+def _attach_nodes(root, node_data, make_node):
+    """
+    Attach a ricecooker node for every entry in node_data under root, using
+    the '/'-separated path of each entry to find its parent. Returns the list
+    of entries whose parent never turned up (orphans).
+    """
+    index = {root.path: root}
+    pending = collections.defaultdict(list)  # parent path -> entries waiting on it
+
+    stack = []
+    for node in node_data:
+        stack.append(node)
+        while stack:
+            node = stack.pop()
+            paths = node['path'].split('/')[:-1]
+            parent = index.get('/'.join(paths[:-1]))
+            if parent is None:
+                pending['/'.join(paths[:-1])].append(node)
+                continue
+            child_node = make_node(node)  # create node based on kinds
+            if not child_node:
+                continue
+            child_node.path = paths[-1]
+            parent.add_child(child_node)
+            node_path = '/'.join(paths)
+            if node_path not in index:
+                index[node_path] = child_node
+                # waiting entries are pushed in reverse so they attach in their original order
+                stack.extend(reversed(pending.pop(node_path, [])))
+
+    return [node for nodes in pending.values() for node in nodes]
 
 
 # utility function to remove topic nodes with no content under them
-def clean_nodes(node):
-    copy_children = copy.copy(node.children)
-    for child in copy_children:
-        if not child.children and child.kind == 'topic':
-            node.children.remove(child)
-        else:
-            idx = node.children.index(child)
-            clean_nodes(node.children[idx])
-    if not node.children and node.kind == 'topic':
-        node.parent.children.remove(node)
+def clean_nodes(root):
+    """
+    Remove every topic node under root that has no content under it, in a single
+    post-order pass over the tree. Returns the number of topic nodes removed.
+    """
+    removed = 0
+    stack = [(root, False)]
+    while stack:
+        node, children_cleaned = stack.pop()
+        if not children_cleaned:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children)
+            continue
+        children = [child for child in node.children if child.children or child.kind != 'topic']
+        removed += len(node.children) - len(children)
+        node.children = children
+    return removed
+
 
 class KASushiChef(SushiChef):
 
@@ -55,26 +178,28 @@ class KASushiChef(SushiChef):
     def construct_channel(self, *args, **kwargs):
 
         lang = kwargs['lang']
-        subprocess.run('make {0}'.format(lang), shell=True, check=True)
-
-        with open('node_data_{0}.pickle'.format(lang), 'rb') as handle:
-            node_data = pickle.load(handle)
+        # delta=true only rebuilds the assessment items that changed since the last run,
+        # strict=true leaves out exercises with any untranslated assessment item content
+        build_language_pack(lang, delta=str(kwargs.get('delta', '')).lower() in ('1', 'true', 'yes'),
+                            strict=str(kwargs.get('strict', '')).lower() in ('1', 'true', 'yes'))
 
-        with open('assessment_data_{0}.pickle'.format(lang), 'rb') as handle:
-            assessment_data = pickle.load(handle)
+        with RecordReader('node_data_{0}'.format(lang)) as node_store:
+            node_data = list(node_store.values())
 
-        # create mapping between ids and each assessment item
-        assessment_dict = {}
-        for item in assessment_data:
-            assessment_dict[item['id']] = item
-
-        tree = _build_tree(node_data, assessment_dict, lang)
-        clean_nodes(tree)
+        # assessment items are only read from disk when their exercise is created
+        with RecordReader('assessment_data_{0}'.format(lang)) as assessment_dict:
+            tree = _build_tree(node_data, assessment_dict, lang)
+        removed = clean_nodes(tree)
+        logging.info("Removed {0} topics with no content under them".format(removed))
 
         return tree
 
 
-def _build_tree(node_data, assessment_dict, lang_code):
+def _build_tree(node_data, assessment_dict, lang_code, exercise_metadata=None, lite_version=None):
+    """
+    Build the channel from node_data. exercise_metadata and lite_version are looked up
+    on KA when not given.
+    """
 
     channel = ChannelNode(
         source_id="KA ({0})".format(lang_code),
@@ -84,20 +209,10 @@ def _build_tree(node_data, assessment_dict, lang_code):
         thumbnail="https://cdn.kastatic.org/images/khan-logo-vertical-transparent.png",
     )
 
-    # recall KA api for exercises dict
-    ka_exercises = requests.get('http://www.khanacademy.org/api/v1/exercises').json()
-    mapping = {}
-    for item in ka_exercises:
-        mapping[item['node_slug'].split('/')[-1]] = item
-
     # adds mastery models and exercise thumbnails
-    for idx in range(len(node_data)):
-        if node_data[idx].get('kind') == 'Exercise':
-            if node_data[idx].get('id') in mapping:
-                copy = node_data[idx]
-                copy['image_url_256'] = mapping[node_data[idx].get('id')]['image_url_256']
-                copy['suggested_completion_criteria'] = mapping[node_data[idx].get('id')]['suggested_completion_criteria']
-                node_data[idx] = copy
+    if exercise_metadata is None:
+        exercise_metadata = retrieve_exercise_metadata()
+    add_exercise_metadata(node_data, exercise_metadata)
 
     # get correct base url
     if lang_code != 'en':
@@ -106,27 +221,30 @@ def _build_tree(node_data, assessment_dict, lang_code):
         base_path = 'https://www.khanacademy.org'
 
     # if not lite version in page content, add previews to questions
-    lite_version = 'format=lite' in requests.get(base_path)
+    if lite_version is None:
+        lite_version = 'format=lite' in client.get(base_path)
 
     channel.path = 'khan'
     node_data.pop(0)
 
-    for node in node_data:
-        paths = node['path'].split('/')[:-1]
-        # recurse tree structure based on paths of node
-        parent = _getNode(paths, channel)
-        # nodes with no parents are being returned by content pack maker, hence this check
-        if parent is None:
-            continue
-        child_node = create_node(node, assessment_dict, base_path, lite_version, lang_code)  # create node based on kinds
-        if child_node and child_node not in parent.children:
-            child_node.path = paths[-1]
-            parent.add_child(child_node)
+    # the question data of exercises is prepared on other processes while the tree is built
+    with ItemLocalizer(node_data, assessment_dict) as localizer:
+        orphans = _attach_nodes(
+            channel,
+            node_data,
+            lambda node: create_node(node, localizer, base_path, lite_version, lang_code),
+        )
+    # nodes with no parents are being returned by content pack maker, so we just report them
+    if orphans:
+        logging.warning("Skipped {count} nodes with no parent in the tree: {paths}".format(
+            count=len(orphans),
+            paths=", ".join(node['path'] for node in orphans[:20])),
+        )
 
     return channel
 
 
-def create_node(node, assessment_dict, base_path, lite_version, lang_code):
+def create_node(node, localizer, base_path, lite_version, lang_code):
 
     kind = node.get('kind')
     # Exercise node creation
@@ -145,16 +263,12 @@ def create_node(node, assessment_dict, base_path, lite_version, lang_code):
         slug = full_path.split('/')[-2]
         full_path = full_path.replace(slug, 'e') + slug
 
-        # attach Perseus questions to Exercises
-        for item in node['all_assessment_items']:
-            # we replace all references to assessment images with the local file path to the image
-            for match in re.finditer(FILE_URL_REGEX, assessment_dict[item['id']]["item_data"]):
-                file_path = str(match.group(0)).replace('\\', '')
-                file_path = file_path.replace(REPLACE_STRING, IMAGE_DL_LOCATION)
-                assessment_dict[item['id']]["item_data"] = re.sub(FILE_URL_REGEX, file_path, assessment_dict[item['id']]["item_data"], 1)
+        # attach Perseus questions to Exercises, with all references to assessment images
+        # replaced with the local file path to the image
+        for item, item_data in zip(node['all_assessment_items'], localizer.item_data(node)):
             question = PerseusQuestion(
                 id=item['id'],
-                raw_data=assessment_dict[item['id']]['item_data'],
+                raw_data=item_data,
                 source_url=full_path if not lite_version else None,
             )
             child_node.add_question(question)
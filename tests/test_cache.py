@@ -0,0 +1,135 @@
+import os
+import time
+
+import pytest
+
+from contentpacks import cache
+from contentpacks.cache import BuildCache, hash_file
+
+
+def store(build_cache, key, path, data):
+    staging_path = build_cache.staging_path(path)
+    with open(staging_path, "wb") as f:
+        f.write(data)
+    build_cache.store(key, staging_path, path)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def build_cache(tmpdir):
+    return BuildCache(str(tmpdir))
+
+
+def test_store_and_lookup(build_cache, tmpdir):
+    path = str(tmpdir.join("sub", "file.png"))
+    assert build_cache.lookup("key", path) is None
+
+    store(build_cache, "key", path, b"contents")
+
+    assert read(path) == b"contents"
+    assert build_cache.lookup("key", path) is True
+    assert os.path.samefile(path, build_cache.object_path(hash_file(path)))
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name != "file.png"]
+
+
+def test_identical_files_share_an_object(build_cache, tmpdir):
+    store(build_cache, "a", str(tmpdir.join("a")), b"same")
+    store(build_cache, "b", str(tmpdir.join("b")), b"same")
+
+    assert build_cache.size() == 4
+
+
+def test_missing_file_is_restored_from_its_object(build_cache, tmpdir):
+    path = str(tmpdir.join("file"))
+    store(build_cache, "key", path, b"contents")
+    os.remove(path)
+
+    assert build_cache.lookup("key", path) is True
+    assert read(path) == b"contents"
+
+
+def test_file_modified_in_place_is_restored(build_cache, tmpdir):
+    path = str(tmpdir.join("file"))
+    store(build_cache, "key", path, b"contents")
+    # break the link first, as an editor saving the file would
+    os.remove(path)
+    with open(path, "wb") as f:
+        f.write(b"tampered")
+
+    assert build_cache.lookup("key", path) is True
+    assert read(path) == b"contents"
+
+
+def test_corrupt_object_is_dropped(build_cache, tmpdir):
+    path = str(tmpdir.join("file"))
+    store(build_cache, "key", path, b"contents")
+    object_path = build_cache.object_path(hash_file(path))
+    os.remove(path)
+    with open(object_path, "wb") as f:
+        f.write(b"corrupt!")
+
+    assert build_cache.lookup("key", path) is False
+    assert build_cache.lookup("key", path) is None
+    assert build_cache.size() == 0
+
+
+def test_replacing_an_entry_frees_its_old_object(build_cache, tmpdir):
+    path = str(tmpdir.join("file"))
+    store(build_cache, "key", path, b"old contents")
+    old_object = build_cache.object_path(hash_file(path))
+
+    store(build_cache, "key", path, b"new")
+
+    assert read(path) == b"new"
+    assert not os.path.exists(old_object)
+    assert build_cache.size() == 3
+
+
+def test_validators_are_kept(build_cache, tmpdir):
+    path = str(tmpdir.join("file"))
+    staging_path = build_cache.staging_path(path)
+    with open(staging_path, "wb") as f:
+        f.write(b"contents")
+    build_cache.store("key", staging_path, path, validators={"etag": '"abc"', "last_modified": None})
+
+    assert build_cache.validators("key") == {"etag": '"abc"', "last_modified": None}
+    assert build_cache.validators("other") == {}
+
+
+def test_size_is_counted_by_existing_manifests(tmpdir):
+    store(BuildCache(str(tmpdir)), "a", str(tmpdir.join("a")), b"12345")
+
+    build_cache = BuildCache(str(tmpdir))
+    store(build_cache, "b", str(tmpdir.join("b")), b"123")
+
+    assert build_cache.size() == 8
+
+
+def test_eviction_removes_least_recently_used_files(tmpdir, monkeypatch):
+    build_cache = BuildCache(str(tmpdir), max_bytes=10)
+    paths = [str(tmpdir.join(name)) for name in "abc"]
+    for i, path in enumerate(paths):
+        store(build_cache, path, path, str(i).encode("ascii") * 4)
+    # the entries were used in an earlier build
+    monkeypatch.setattr(cache, "_SESSION_START", time.time() + 1)
+
+    build_cache.lookup(paths[0], paths[0])
+    store(build_cache, "d", str(tmpdir.join("d")), b"dddd")
+
+    assert build_cache.size() <= 10
+    assert os.path.exists(paths[0])
+    assert not os.path.exists(paths[1])
+    assert build_cache.lookup(paths[1], paths[1]) is None
+
+
+def test_files_used_by_the_current_build_are_not_evicted(tmpdir):
+    build_cache = BuildCache(str(tmpdir), max_bytes=4)
+    store(build_cache, "a", str(tmpdir.join("a")), b"aaaa")
+    store(build_cache, "b", str(tmpdir.join("b")), b"bbbb")
+
+    assert os.path.exists(str(tmpdir.join("a")))
+    assert build_cache.size() == 8
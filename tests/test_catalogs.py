@@ -0,0 +1,157 @@
+import itertools
+import pickle
+import zipfile
+import zlib
+
+import pytest
+from hypothesis import given, strategies as st
+
+from contentpacks import catalogs
+from contentpacks.catalogs import CompiledCatalog, compile_catalog, load_catalog, compiled_catalog_path, _hash_size
+
+PO_TEMPLATE = """
+msgid ""
+msgstr ""
+"Content-Type: text/plain; charset=UTF-8\\n"
+
+{entries}
+"""
+
+
+def make_po(entries: dict) -> str:
+    return PO_TEMPLATE.format(entries="\n".join('msgid "{}"\nmsgstr "{}"\n'.format(msgid, msgstr)
+                                                for msgid, msgstr in entries.items()))
+
+
+def make_zip(path, files: dict) -> str:
+    with zipfile.ZipFile(str(path), "w") as zf:
+        for name, entries in files.items():
+            zf.writestr(name, make_po(entries))
+    return str(path)
+
+
+def colliding_msgids(count: int, total: int) -> list:
+    """
+    Return count msgids that all land in the same hash slot of a catalog of total strings.
+    """
+    hash_size = _hash_size(total)
+    by_slot = {}
+    for i in itertools.count():
+        msgid = "msgid {}".format(i)
+        msgids = by_slot.setdefault(zlib.crc32(msgid.encode("utf-8")) % hash_size, [])
+        msgids.append(msgid)
+        if len(msgids) == count:
+            return msgids
+
+
+@given(st.dictionaries(st.text(), st.text()))
+def test_round_trip(tmpdir_factory, catalog):
+    path = str(tmpdir_factory.mktemp("catalogs").join("test.catalog"))
+    compile_catalog(catalog, path)
+
+    compiled = CompiledCatalog(path)
+    try:
+        assert len(compiled) == len(catalog)
+        assert list(compiled) == sorted(catalog)
+        assert dict(compiled) == catalog
+        for msgid, msgstr in catalog.items():
+            assert compiled[msgid] == msgstr
+    finally:
+        compiled.close()
+
+
+def test_colliding_msgids(tmpdir):
+    msgids = colliding_msgids(5, total=8)
+    catalog = {msgid: msgid.upper() for msgid in msgids[:4]}
+    catalog.update({"other {}".format(i): "" for i in range(4)})
+    path = str(tmpdir.join("test.catalog"))
+    compile_catalog(catalog, path)
+
+    compiled = CompiledCatalog(path)
+    for msgid in msgids[:4]:
+        assert compiled[msgid] == msgid.upper()
+    # a missing msgid probes past every msgid in its slot
+    assert msgids[4] not in compiled
+    with pytest.raises(KeyError):
+        compiled[msgids[4]]
+
+
+def test_missing_and_non_string_keys(tmpdir):
+    path = str(tmpdir.join("test.catalog"))
+    compile_catalog({"": "", "Hello": "Hola"}, path)
+    compiled = CompiledCatalog(path)
+
+    assert compiled.get("Goodbye") is None
+    assert compiled.get(None) is None
+    assert compiled.get(b"Hello") is None
+    assert compiled[""] == ""
+
+
+def test_empty_catalog(tmpdir):
+    path = str(tmpdir.join("test.catalog"))
+    compile_catalog({}, path)
+    compiled = CompiledCatalog(path)
+
+    assert len(compiled) == 0
+    assert "anything" not in compiled
+
+
+def test_pickled_as_its_path(tmpdir):
+    path = str(tmpdir.join("test.catalog"))
+    compile_catalog({"Hello": "Hola"}, path)
+
+    compiled = pickle.loads(pickle.dumps(CompiledCatalog(path)))
+
+    assert compiled.path == path
+    assert compiled["Hello"] == "Hola"
+
+
+@pytest.mark.parametrize("data", [b"", b"not a catalog at all", catalogs.MAGIC + b"\xff\xff\xff\xff\x01\x00\x00\x00"])
+def test_corrupt_file_raises(tmpdir, data):
+    path = tmpdir.join("test.catalog")
+    path.write_binary(data)
+
+    with pytest.raises(ValueError):
+        CompiledCatalog(str(path))
+
+
+def test_load_catalog_compiles_once(tmpdir, monkeypatch):
+    zip_path = make_zip(tmpdir.join("fr.zip"), {
+        "a.po": {"Hello": "Bonjour", "Untranslated": ""},
+        "b.po": {"Hello": "Salut", "Bye": "Au revoir"},
+        "c.txt": {"Ignored": "Ignoré"},
+    })
+    cachedir = str(tmpdir.join("build"))
+
+    catalog = load_catalog(zip_path, cachedir=cachedir)
+
+    # later files win, and untranslated strings are left out
+    assert dict(catalog) == {"": "", "Hello": "Salut", "Bye": "Au revoir"}
+    assert catalog.path == compiled_catalog_path(zip_path, "*.po", cachedir)
+
+    def build_catalog(*args):
+        raise AssertionError("the catalog was compiled again")
+    monkeypatch.setattr(catalogs, "build_catalog", build_catalog)
+    assert dict(load_catalog(zip_path, cachedir=cachedir)) == dict(catalog)
+
+
+def test_load_catalog_is_keyed_by_zip_contents_and_includes(tmpdir):
+    cachedir = str(tmpdir.join("build"))
+    zip_path = make_zip(tmpdir.join("fr.zip"), {"a.po": {"Hello": "Bonjour"}, "b.po": {"Bye": "Au revoir"}})
+
+    assert dict(load_catalog(zip_path, includes="a.po", cachedir=cachedir)) == {"": "", "Hello": "Bonjour"}
+    assert dict(load_catalog(zip_path, includes="b.po", cachedir=cachedir)) == {"": "", "Bye": "Au revoir"}
+
+    make_zip(zip_path, {"a.po": {"Hello": "Salut"}})
+    assert dict(load_catalog(zip_path, includes="a.po", cachedir=cachedir)) == {"": "", "Hello": "Salut"}
+
+
+def test_load_catalog_recompiles_a_corrupt_catalog(tmpdir):
+    zip_path = make_zip(tmpdir.join("fr.zip"), {"a.po": {"Hello": "Bonjour"}})
+    cachedir = str(tmpdir.join("build"))
+    path = compiled_catalog_path(zip_path, "*.po", cachedir)
+    tmpdir.join("build", catalogs.CATALOG_DIR).ensure(dir=True)
+    with open(path, "wb") as f:
+        f.write(b"garbage")
+
+    assert load_catalog(zip_path, cachedir=cachedir)["Hello"] == "Bonjour"
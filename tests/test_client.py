@@ -0,0 +1,210 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from contentpacks import client
+
+BODY = bytes(range(256)) * 64
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serves server.body at every path after server.delay seconds, or a 404 if
+    server.missing, honouring Range requests whose If-Range matches server.etag. Each request is answered with at most the next of server.cut_after
+    bytes, after which the connection is dropped.
+    """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        time.sleep(server.delay)
+
+        if server.missing:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = server.body
+        start = 0
+        range_header = self.headers.get("Range")
+        if server.honor_range and range_header and self.headers.get("If-Range") == server.etag:
+            start = int(range_header[len("bytes="):].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.send_header("ETag", server.etag)
+        self.end_headers()
+
+        limit = server.cut_after.pop(0) if server.cut_after else None
+        self.wfile.write(body[start:] if limit is None else body[start:start + limit])
+        self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(client, "backoff_delay", lambda attempt: 0)
+    # only whole chunks make it to the partial file, so cuts are made on chunk boundaries
+    monkeypatch.setattr(client, "DOWNLOAD_CHUNK_SIZE", 500)
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    httpd.body = BODY
+    httpd.etag = '"v1"'
+    httpd.cut_after = []
+    httpd.honor_range = True
+    httpd.missing = False
+    httpd.delay = 0
+    httpd.requests = []
+    httpd.url = "http://127.0.0.1:{}/file.bin".format(httpd.server_port)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def leftovers(tmpdir):
+    return [name for name in os.listdir(str(tmpdir)) if name != "file.bin"]
+
+
+def test_download(server, tmpdir):
+    path = str(tmpdir.join("file.bin"))
+
+    assert client.download(server.url, path) == {"etag": '"v1"', "last_modified": None}
+    assert read(path) == BODY
+    assert leftovers(tmpdir) == []
+
+
+def test_interrupted_download_is_resumed(server, tmpdir):
+    server.cut_after = [1000, 3000]
+    path = str(tmpdir.join("file.bin"))
+
+    client.download(server.url, path)
+
+    assert read(path) == BODY
+    assert [request.get("Range") for request in server.requests] == [None, "bytes=1000-", "bytes=4000-"]
+    assert all(request.get("If-Range") == '"v1"' for request in server.requests[1:])
+    assert leftovers(tmpdir) == []
+
+
+def test_download_is_resumed_by_the_next_call(server, tmpdir):
+    server.cut_after = [5000]
+    path = str(tmpdir.join("file.bin"))
+
+    with pytest.raises(client.requests.RequestException):
+        client.download(server.url, path, max_attempts=1)
+    assert not os.path.exists(path)
+
+    client.download(server.url, path)
+
+    assert read(path) == BODY
+    assert server.requests[-1].get("Range") == "bytes=5000-"
+    assert leftovers(tmpdir) == []
+
+
+def test_download_restarts_when_the_file_changed(server, tmpdir):
+    server.cut_after = [5000]
+    path = str(tmpdir.join("file.bin"))
+    with pytest.raises(client.requests.RequestException):
+        client.download(server.url, path, max_attempts=1)
+
+    server.body = b"new contents" * 100
+    server.etag = '"v2"'
+    assert client.download(server.url, path)["etag"] == '"v2"'
+
+    assert read(path) == server.body
+
+
+def test_download_restarts_when_ranges_are_ignored(server, tmpdir):
+    server.cut_after = [5000]
+    server.honor_range = False
+    path = str(tmpdir.join("file.bin"))
+
+    client.download(server.url, path)
+
+    assert read(path) == BODY
+
+
+def test_checksum_mismatch_discards_the_download(server, tmpdir):
+    path = str(tmpdir.join("file.bin"))
+
+    with pytest.raises(client.DownloadError):
+        client.download(server.url, path, sha256=hashlib.sha256(b"something else").hexdigest())
+    assert not os.path.exists(path)
+    assert os.listdir(str(tmpdir)) == []
+
+    client.download(server.url, path, sha256=hashlib.sha256(BODY).hexdigest())
+    assert read(path) == BODY
+
+
+def test_not_modified(server, tmpdir):
+    path = str(tmpdir.join("file.bin"))
+
+    assert client.download(server.url, path, validators={"etag": '"v1"'}) is None
+    assert not os.path.exists(path)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_missing_file_leaves_nothing_behind(server, tmpdir):
+    server.missing = True
+    path = str(tmpdir.join("file.bin"))
+
+    with pytest.raises(client.requests.HTTPError):
+        client.download(server.url, path)
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_copy_downloaded_alongside_another_process_is_removed(server, tmpdir):
+    server.cut_after = [5000]
+    path = str(tmpdir.join("file.bin"))
+    part_path = str(tmpdir.join(".{}.part".format(hashlib.sha1(server.url.encode("utf-8")).hexdigest())))
+
+    with open(part_path, "ab") as part:
+        # another process is downloading the same url
+        fcntl.flock(part, fcntl.LOCK_EX)
+        with pytest.raises(client.requests.RequestException):
+            client.download(server.url, path, max_attempts=1)
+        assert os.listdir(str(tmpdir)) == [os.path.basename(part_path)]
+
+        client.download(server.url, path)
+        assert read(path) == BODY
+
+
+def test_stalled_requests_time_out_and_are_retried(server, monkeypatch, caplog):
+    monkeypatch.setattr(client, "READ_TIMEOUT", 0.1)
+    server.delay = 0.5
+
+    with pytest.raises(client.requests.Timeout):
+        client.get(server.url, max_attempts=2)
+    assert "Attempt 1: got error requesting" in caplog.text
+
+
+def test_rate_limits_are_shared_out(monkeypatch):
+    monkeypatch.setattr(client, "_hosts", {})
+    monkeypatch.setattr(client, "_rate_limit_share", 1)
+
+    client.share_rate_limits(4)
+    bucket, circuit = client._get_host_limits("http://example.com/file")
+
+    assert bucket.rate == client.RATE_LIMIT / 4
+    assert bucket.capacity == client.RATE_LIMIT_BURST // 4
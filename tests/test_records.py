@@ -0,0 +1,79 @@
+import os
+
+from hypothesis import given, strategies as st
+
+from contentpacks.models import NodeRecord
+from contentpacks.records import RecordReader, RecordWriter, replace_store, INDEX_SUFFIX, RECORDS_SUFFIX
+
+json_values = st.recursive(
+    st.none() | st.booleans() | st.integers(-2 ** 53, 2 ** 53) | st.text(),
+    lambda children: st.lists(children, max_size=4) | st.dictionaries(st.text(), children, max_size=4),
+    max_leaves=20,
+)
+
+
+@given(records=st.lists(st.dictionaries(st.text(), json_values, max_size=5), max_size=20))
+def test_round_trip(tmpdir_factory, records):
+    path = str(tmpdir_factory.mktemp("store").join("data"))
+    with RecordWriter(path) as writer:
+        for record in records:
+            writer.append(record)
+    assert len(writer) == len(records)
+
+    with RecordReader(path) as reader:
+        assert list(reader) == [str(i) for i in range(len(records))]
+        assert list(reader.values()) == records
+
+
+def test_keyed_records_are_read_by_key(tmpdir):
+    path = str(tmpdir.join("data"))
+    with RecordWriter(path) as writer:
+        writer.append({"id": "b", "text": "line\nbreak"}, key="b")
+        writer.append({"id": "a", "text": "ünïcödé"}, key="a")
+    assert writer.keys == {"a", "b"}
+
+    with RecordReader(path) as reader:
+        assert list(reader) == ["b", "a"]
+        assert reader["a"] == {"id": "a", "text": "ünïcödé"}
+        assert reader["b"] == {"id": "b", "text": "line\nbreak"}
+        assert "c" not in reader
+        assert reader.get("c") is None
+
+
+def test_node_records_are_stored_as_dicts(tmpdir):
+    path = str(tmpdir.join("nodes"))
+    node = NodeRecord(id="x", kind="Video", sort_order=1.0, extra_field=[1, 2])
+    with RecordWriter(path) as writer:
+        writer.append(node)
+
+    with RecordReader(path) as reader:
+        assert reader["0"] == {"id": "x", "kind": "Video", "sort_order": 1.0, "extra_field": [1, 2]}
+
+
+def test_replace_store(tmpdir):
+    old = str(tmpdir.join("data"))
+    new = str(tmpdir.join("data.new"))
+    with RecordWriter(old) as writer:
+        writer.append({"v": 1}, key="old")
+    with RecordWriter(new) as writer:
+        writer.append({"v": 2}, key="new")
+
+    replace_store(new, old)
+
+    assert not os.path.exists(new + RECORDS_SUFFIX)
+    assert not os.path.exists(new + INDEX_SUFFIX)
+    with RecordReader(old) as reader:
+        assert dict(reader) == {"new": {"v": 2}}
+
+
+def test_discarded_records_are_left_out(tmpdir):
+    path = str(tmpdir.join("data"))
+    with RecordWriter(path) as writer:
+        writer.append({"v": 1}, key="a")
+        writer.append({"v": 2}, key="b")
+        writer.discard("a")
+        writer.append({"v": 3})
+    assert writer.keys == {"b", "2"}
+
+    with RecordReader(path) as reader:
+        assert dict(reader) == {"b": {"v": 2}, "2": {"v": 3}}
@@ -0,0 +1,58 @@
+import requests
+from requests.adapters import BaseAdapter
+
+from contentpacks.replay import Archive, RecordingAdapter, build_response
+
+
+class FakeAdapter(BaseAdapter):
+    """
+    Answers requests with the given status, a 304 to conditional ones and a 206 to
+    range ones, and keeps the requests it got.
+    """
+
+    def __init__(self, status=200):
+        super().__init__()
+        self.status = status
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        if "If-None-Match" in request.headers:
+            return build_response(request, 304, "Not Modified", {}, b"")
+        if "Range" in request.headers:
+            return build_response(request, 206, "Partial Content", {}, b"ole")
+        return build_response(request, self.status, "", {}, b"whole")
+
+    def close(self):
+        pass
+
+
+def session_with(adapter, archive):
+    session = requests.Session()
+    session.mount("http://", RecordingAdapter(adapter, archive))
+    return session
+
+
+def test_conditional_and_range_headers_are_not_sent_while_recording(tmpdir):
+    archive = Archive(str(tmpdir.join("archive.sqlite3")))
+    adapter = FakeAdapter()
+    session = session_with(adapter, archive)
+
+    response = session.get("http://example.com/file", headers={"If-None-Match": '"abc"', "Range": "bytes=2-"})
+
+    assert response.status_code == 200
+    assert "If-None-Match" not in adapter.requests[0].headers
+    assert "Range" not in adapter.requests[0].headers
+    assert archive.load("GET", "http://example.com/file")[::3] == (200, b"whole")
+
+
+def test_recorded_200_is_not_replaced_by_an_error(tmpdir):
+    archive = Archive(str(tmpdir.join("archive.sqlite3")))
+    session_with(FakeAdapter(), archive).get("http://example.com/file")
+    session_with(FakeAdapter(500), archive).get("http://example.com/file")
+
+    assert archive.load("GET", "http://example.com/file")[::3] == (200, b"whole")
+
+    archive.save("GET", "http://example.com/missing", 404, "Not Found", {}, b"")
+    archive.save("GET", "http://example.com/missing", 200, "OK", {}, b"found")
+    assert archive.load("GET", "http://example.com/missing")[::3] == (200, b"found")
@@ -0,0 +1,145 @@
+import json
+import os
+
+import pytest
+from hypothesis import given, strategies as st
+
+from contentpacks import client
+from contentpacks.cache import get_cache, hash_file
+from contentpacks.utils import iter_json_arrays, cache_file, NOT_MODIFIED
+
+json_values = st.recursive(
+    st.none() | st.booleans() | st.integers() | st.floats(allow_nan=False, allow_infinity=False) | st.text(),
+    lambda children: st.lists(children, max_size=4) | st.dictionaries(st.text(), children, max_size=4),
+    max_leaves=20,
+)
+
+json_arrays = st.dictionaries(st.text(), st.lists(json_values, max_size=5), max_size=4)
+
+
+def split(data: bytes, cuts):
+    cuts = sorted(set(cut % (len(data) + 1) for cut in cuts))
+    return [data[start:end] for start, end in zip([0] + cuts, cuts + [len(data)])]
+
+
+def elements(arrays: dict):
+    return [(key, value) for key, values in arrays.items() for value in values]
+
+
+@given(arrays=json_arrays, cuts=st.lists(st.integers(min_value=0), max_size=30), indent=st.sampled_from([None, 0, 2]))
+def test_any_chunking_parses_the_same(arrays, cuts, indent):
+    data = json.dumps(arrays, ensure_ascii=False, indent=indent).encode("utf-8")
+
+    assert list(iter_json_arrays(split(data, cuts))) == elements(arrays)
+
+
+@given(arrays=json_arrays)
+def test_one_byte_chunks(arrays):
+    data = json.dumps(arrays, ensure_ascii=False).encode("utf-8")
+
+    assert list(iter_json_arrays(data[i:i + 1] for i in range(len(data)))) == elements(arrays)
+
+
+@pytest.mark.parametrize("chunks", [
+    [b'{"a": [12', b'34, 5.', b'5e', b'1]}'],
+    [b'{"a": [1234', b'], "b": [-', b'0.5]}'],
+    [b'{"a": [1234]', b'}'],
+])
+def test_numbers_split_across_chunks(chunks):
+    assert list(iter_json_arrays(chunks)) == list(iter_json_arrays([b"".join(chunks)]))
+    assert list(iter_json_arrays(chunks)) == elements(json.loads(b"".join(chunks).decode("utf-8")))
+
+
+def test_multibyte_characters_split_across_chunks():
+    data = json.dumps({"topics": [{"title": "Kiswahili ✓ 数学"}]}, ensure_ascii=False).encode("utf-8")
+    check = data.index("✓".encode("utf-8"))
+
+    chunks = [data[:check + 1], data[check + 1:check + 2], data[check + 2:]]
+
+    assert list(iter_json_arrays(chunks)) == [("topics", {"title": "Kiswahili ✓ 数学"})]
+
+
+def test_empty_chunks_are_skipped():
+    assert list(iter_json_arrays([b"", b'{"a"', b"", b": []", b"", b', "b": [1]}', b""])) == [("b", 1)]
+
+
+def test_elements_are_yielded_as_they_are_read():
+    def chunks():
+        yield b'{"topics": [{"id": 1}, '
+        raise AssertionError("read past the first element")
+
+    assert next(iter_json_arrays(chunks())) == ("topics", {"id": 1})
+
+
+@pytest.mark.parametrize("data", [
+    b'["a"]',
+    b'{"a": 1}',
+    b'{"a": [1 2]}',
+    b'{"a": [1]',
+    b'{"a": [{"b": ]}',
+])
+def test_malformed_input_raises(data):
+    with pytest.raises(ValueError):
+        list(iter_json_arrays([data]))
+
+
+def make_fetch(responses, on_not_modified=None):
+    """
+    Return a cache_file function answering with responses in turn, each either the
+    contents of a file or NOT_MODIFIED, and the list of validators it was called with.
+    """
+    calls = []
+
+    @cache_file
+    def fetch(url, path, validators=None):
+        calls.append(validators)
+        contents = responses.pop(0)
+        if contents is NOT_MODIFIED:
+            if on_not_modified:
+                on_not_modified()
+            return NOT_MODIFIED
+        with open(path, "w") as f:
+            f.write(contents)
+        return {"etag": contents, "last_modified": None}
+
+    return fetch, calls
+
+
+def read_text(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def test_cache_file_keeps_the_cached_file_when_not_modified(tmpdir):
+    fetch, calls = make_fetch(["v1", NOT_MODIFIED])
+    path = fetch("http://example.com/file.json", cachedir=str(tmpdir))
+
+    assert fetch("http://example.com/file.json", cachedir=str(tmpdir), ignorecache=True) == path
+    assert calls == [{}, {"etag": "v1", "last_modified": None}]
+    assert read_text(path) == "v1"
+
+
+def test_cache_file_downloads_again_when_the_cached_file_is_gone(tmpdir):
+    cachedir = str(tmpdir)
+
+    def evict():
+        # the cached file is evicted by another build while the request is made
+        path = str(tmpdir.join("file.json"))
+        os.remove(get_cache(cachedir).object_path(hash_file(path)))
+        os.remove(path)
+
+    fetch, calls = make_fetch(["v1", NOT_MODIFIED, "v1"], on_not_modified=evict)
+    path = fetch("http://example.com/file.json", cachedir=cachedir)
+
+    assert fetch("http://example.com/file.json", cachedir=cachedir, ignorecache=True) == path
+    assert calls == [{}, {"etag": "v1", "last_modified": None}, {}]
+    assert read_text(path) == "v1"
+
+
+def test_cache_file_rejects_a_304_to_an_unconditional_request(tmpdir):
+    fetch, calls = make_fetch([NOT_MODIFIED])
+
+    with pytest.raises(client.DownloadError):
+        fetch("http://example.com/file.json", cachedir=str(tmpdir), ignorecache=True)
+    assert calls == [{}]
+    assert not os.path.exists(str(tmpdir.join("file.json")))